@@ -2,6 +2,7 @@ from enum import Enum
 
 import numpy as np
 
+from rdr2_ai import config
 from rdr2_ai.configWindow.configWindowTemplate import ConfigWindowTemplate,ContentType
 from rdr2_ai.module import Module
 from rdr2_ai.controls.actionHandler import ActionType
@@ -31,13 +32,19 @@ class Chorer(Module):
 
     def __init__(self, configWindow=None):
         self.configWindow = configWindow
-        self.optionsGetter = OptionsGetter(configWindow=configWindow)
+        self.optionsGetter = OptionsGetter(configWindow=configWindow,
+                                           recognizer=config.optionsRecognizer['chores'])
         self.minimapReader = MinimapReader(configWindow=configWindow)
         self.currChoreState = ChoreState.GOTOCHORE # change to findchores once implemented
         self.currChoreType = None
 
     def cleanup(self):
         self.optionsGetter.cleanup()
+        self.minimapReader.cleanup()
+
+    def requiredRegions(self, frameSize):
+        return (self.optionsGetter.requiredRegions(frameSize) +
+                self.minimapReader.requiredRegions(frameSize))
 
     def getActionsForMove(self, playerPoint, targetPoint):
         choreX, choreY = targetPoint
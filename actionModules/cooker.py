@@ -1,3 +1,4 @@
+from rdr2_ai import config
 from rdr2_ai.controls.actionHandler import ActionType
 from rdr2_ai.configWindow.configWindowTemplate import ConfigWindowTemplate, ContentType
 from rdr2_ai.module import Module
@@ -18,11 +19,15 @@ class Cooker(Module):
 
     def __init__(self, configWindow=None):
         self.configWindow = configWindow
-        self.optionsGetter = OptionsGetter(configWindow=configWindow, showInConfigWindow=True)
+        self.optionsGetter = OptionsGetter(configWindow=configWindow, showInConfigWindow=True,
+                                           recognizer=config.optionsRecognizer['cook'])
 
     def cleanup(self):
         self.optionsGetter.cleanup()
 
+    def requiredRegions(self, frameSize):
+        return self.optionsGetter.requiredRegions(frameSize)
+
     def getActions(self, frame):
         
         # get options
@@ -2,24 +2,27 @@ from dataclasses import dataclass
 from enum import Enum, IntEnum, auto
 from time import time, time_ns
 from random import random
+from math import ceil
 import os
 
 import cv2
 import numpy as np
-from scipy.signal import convolve2d
-import matplotlib.pyplot as plt
 from pprint import PrettyPrinter
 from pynput.keyboard import Listener
 
+from rdr2_ai import config
 from rdr2_ai.configWindow.configWindow import ConfigWindow
 from rdr2_ai.configWindow.configWindowTemplate import ConfigWindowTemplate,ContentType
 from rdr2_ai.controls.actionHandler import ActionType
 from rdr2_ai.data.collector import FishData
 from rdr2_ai.module import Module
 from rdr2_ai.utils.state import StateMachine
-from rdr2_ai.utils.utils import allAnyCloseEnough, anyCloseEnough, closeEnough
+from rdr2_ai.utils.matcher import getMatcher
+from rdr2_ai.utils.timeSeries import TimeSeries
 from rdr2_ai.analysisModules.options import OptionsGetter
 from rdr2_ai.analysisModules.pause import PauseMenu
+from rdr2_ai.analysisModules.splash import SplashScorer
+from rdr2_ai.analysisModules.calm import CalmClassifier
 
 
 fisherConfigWindowTemplate = ConfigWindowTemplate()
@@ -62,6 +65,8 @@ class FisherState(IntEnum):
 
 class FisherStateMachine(StateMachine):
 
+    # state functions get the frame's options as PromptMatches (utils.matcher)
+
     def __init__(self, swingDuration: float = 2,
                        defaultReelSpeed: int = 10,
                        maxReelSpeed: int = 20,
@@ -114,15 +119,15 @@ class FisherStateMachine(StateMachine):
             else:
                 return [], FisherState.PRE
         
-        if len(options) == 1 and closeEnough('bait', options[0]):
+        if len(options) == 1 and options.at(0, 'bait'):
             # not begun fishing yet, but is ready to
             return [(ActionType.HOLD, 'MOUSE_RIGHT')], FisherState.GRIPPED
 
-        if len(options) == 2 and anyCloseEnough('bait', options):
+        if len(options) == 2 and options.has('bait'):
             # equip previous bait/lure
             return [(ActionType.TAP, 'e')], FisherState.PRE
 
-        if anyCloseEnough('grip reel', options):
+        if options.has('grip reel'):
             # we are not gripping  the reel
             return [(ActionType.HOLD, 'MOUSE_RIGHT')], FisherState.GRIPPED
         
@@ -130,7 +135,7 @@ class FisherStateMachine(StateMachine):
         if len(options) == 0:
             # start swing back
             return [(ActionType.HOLD, 'MOUSE_LEFT')], FisherState.SWING_BACK
-        elif anyCloseEnough('bait', options):
+        elif options.has('bait'):
             # we did not grip the rod
             return [(ActionType.RELEASE, 'MOUSE_RIGHT')], FisherState.PRE
     
@@ -150,19 +155,19 @@ class FisherStateMachine(StateMachine):
             # bait/lure has not hit the water yet
             return [], FisherState.CAST_OUT
         
-        if len(options) == 2 and allAnyCloseEnough(options, ('reel in','reel lure','reset cast')):
+        if len(options) == 2 and options.allIn(('reel in','reel lure','reset cast')):
             # bait/lure hit the water
             return [(ActionType.HOLD, 'SPACEBAR')], FisherState.REEL_IN
     
     def reelIn(self, options):
 
-        if ((len(options) > 1 and anyCloseEnough('control', options)) or
-            (len(options) == 3 and allAnyCloseEnough(options, ('reel in','reel lure','reset cast', 'hook fish')))):
+        if ((len(options) > 1 and options.has('control')) or
+            (len(options) == 3 and options.allIn(('reel in','reel lure','reset cast', 'hook fish')))):
             # we should not be reeling in, we have a fish hooked or fish just bit
             self.reelSpeed = self.defaultReelSpeed
             return [(ActionType.TAP, 'MOUSE_LEFT'), (ActionType.RELEASE, 'SPACEBAR')], FisherState.HOOK_ATTEMPT
         
-        if len(options) == 2 and allAnyCloseEnough(options, ('reel in','reel lure','reset cast')):
+        if len(options) == 2 and options.allIn(('reel in','reel lure','reset cast')):
             # still reeling in, go as slow as possible
             if self.reelSpeed > 0:
                 decreaseAmount = min(2, self.reelSpeed)
@@ -174,8 +179,8 @@ class FisherStateMachine(StateMachine):
             return actions, FisherState.REEL_IN
 
         if ((len(options) == 0) or
-            (len(options) == 1 and closeEnough(options[0], 'bait')) or
-            (len(options) == 2 and anyCloseEnough('bait', options))):
+            (len(options) == 1 and options.at(0, 'bait')) or
+            (len(options) == 2 and options.has('bait'))):
             # fully reeled in and didn't get a fish
             return [(ActionType.RELEASE, 'ALL')], FisherState.DONE_REELING
     
@@ -183,34 +188,34 @@ class FisherStateMachine(StateMachine):
         
         self.hookAttemptStartTime = time()
 
-        if len(options) == 3 and allAnyCloseEnough(options, ('reel in','reel lure','reset cast','hook fish')):
+        if len(options) == 3 and options.allIn(('reel in','reel lure','reset cast','hook fish')):
             # attempt to hook fish failed, but fish is still nibbling
             return [(ActionType.TAP, 'MOUSE_LEFT')], FisherState.HOOK_ATTEMPT
         
-        if len(options) >= 2 and allAnyCloseEnough(options, ('reel in','reel lure','cut line','reset cast')):
+        if len(options) >= 2 and options.allIn(('reel in','reel lure','cut line','reset cast')):
             # attempt to hook fish failed, lost fish, but line is not cut
             self.reelSpeed = self.defaultReelSpeed
             return [(ActionType.HOLD, 'SPACEBAR')], FisherState.REEL_IN
         
-        if len(options) == 3 and allAnyCloseEnough(options, ('reel in', 'cut line', 'control')):
+        if len(options) == 3 and options.allIn(('reel in', 'cut line', 'control')):
             # attempt to hook was successful, start off with no reeling
             return [], FisherState.FISH_HOOKED
     
     def fishHooked(self, options):
-        if len(options) == 3 and allAnyCloseEnough(options, ('reel in','cut line','control')):
+        if len(options) == 3 and options.allIn(('reel in','cut line','control')):
             # reeling in fish
             return [], FisherState.FISH_HOOKED
         
-        if len(options) == 2 and anyCloseEnough('reset cast', options):
+        if len(options) == 2 and options.has('reset cast'):
             # lost fish, but line is not cut
             self.reelSpeed = self.defaultReelSpeed
             return [(ActionType.HOLD, 'SPACEBAR')], FisherState.REEL_IN
         
         if ((len(options) == 0 and time() - self.hookAttemptStartTime > self.hookAttemptTimeout) or
-            (len(options) == 1 and closeEnough(options[0], 'bait')) or # fish was lost
-            (len(options) == 2 and anyCloseEnough('bait', options)) or # fish was lost
-            (len(options) == 2 and allAnyCloseEnough(options, ('keep','throw back'))) or
-            (len(options) == 1 and allAnyCloseEnough(options, ('keep','throw back')))): # fish was caught
+            (len(options) == 1 and options.at(0, 'bait')) or # fish was lost
+            (len(options) == 2 and options.has('bait')) or # fish was lost
+            (len(options) == 2 and options.allIn(('keep','throw back'))) or
+            (len(options) == 1 and options.allIn(('keep','throw back')))): # fish was caught
             # fully reeled in
             return [(ActionType.RELEASE, 'ALL')], FisherState.DONE_REELING
         
@@ -223,12 +228,12 @@ class FisherStateMachine(StateMachine):
             # auto-reeling in, wait it out
             return [], FisherState.DONE_REELING
         
-        if ((len(options) == 1 and closeEnough(options[0], 'bait')) or
-            (len(options) == 2 and anyCloseEnough('bait', options))):
+        if ((len(options) == 1 and options.at(0, 'bait')) or
+            (len(options) == 2 and options.has('bait'))):
             # didn't catch a fish
             return [], FisherState.PRE
         
-        if len(options) == 2 and allAnyCloseEnough(options, ('keep','throw back')):
+        if len(options) == 2 and options.allIn(('keep','throw back')):
             return [], FisherState.FISH_IN_HAND
         
     def fishInHand(self, options):
@@ -251,11 +256,14 @@ class Fisher(Module):
 
     SKIP = 2
     LOG = False
+    LOG_PAD = 50
 
     def __init__(self, configWindow: ConfigWindow = None):
         self.configWindow = configWindow
-        self.optionsGetter = OptionsGetter(configWindow=configWindow, showInConfigWindow=True)
+        self.optionsGetter = OptionsGetter(configWindow=configWindow, showInConfigWindow=True,
+                                           recognizer=config.optionsRecognizer['fish'])
         self.stateMachine = FisherStateMachine(pctKeepFish=0)
+        self.promptMatcher = getMatcher(config.knownPrompts)
 
         self.startTime = time()
 
@@ -264,20 +272,20 @@ class Fisher(Module):
         self.yankPeriod = 5
 
         self.bufferLength = 15
-        self.calmPxMax = np.array([-1 for _ in range(self.bufferLength)], dtype=np.float32)
+        self.calmPxMax = TimeSeries(self.bufferLength, fill=-1)
         self.calmState = False
-        self.calmScores = np.array([-1 for _ in range(self.bufferLength)], dtype=np.float32)
-        self.splashMean = None
-
-        # disgusting
-        KH = 10 / Fisher.SKIP
-        KW = 15 / Fisher.SKIP
-        filtr_o_h = np.linspace(0,1,int(KH))
-        filtr_o_w = np.linspace(0,1,int(KW))
-        filtr_h = np.append(np.append(filtr_o_h,[1]),np.flip(filtr_o_h))
-        filtr_w = np.append(np.append(filtr_o_w,[1]),np.flip(filtr_o_w))
-        filtr = np.add.outer(filtr_h,filtr_w) / 2
-        self.splashConvFilter = filtr ** 3
+        self.calmScores = TimeSeries(self.bufferLength, fill=-1, window=2)
+        self.calmScoresSm2 = TimeSeries(self.bufferLength - 1, fill=-1)
+        self.splashScorer = SplashScorer(skip=Fisher.SKIP, bufferLength=self.bufferLength)
+
+        # learned calm decision instead of the sign change rule
+        self.calmClassifier = None
+        if config.fishCalmDecision == 'model':
+            calmClassifier = CalmClassifier()
+            if calmClassifier.exists():
+                self.calmClassifier = calmClassifier.load()
+            else:
+                self.print(f'no calm model at {calmClassifier.modelPath} (train it with data/calmTrainer.py), using the rule.')
 
         # temp data collection
         if Fisher.LOG:
@@ -301,17 +309,20 @@ class Fisher(Module):
 
     def cleanup(self):
         self.optionsGetter.cleanup()
+        if Fisher.LOG:
+            self.dataCollector.cleanup()
 
         if self.stateMachine.invalidQueries:
             PrettyPrinter().pprint(self.stateMachine.invalidQueries)
 
     def getActions(self, frame):
 
-        # use options to get actions
+        # use options to get actions, matched against the known prompts once
         options = self.optionsGetter.getOptions(frame)
+        prompts = self.promptMatcher.compile(options)
         
         # iterate fsm
-        actions = self.stateMachine.getActionsAndUpdateState(options)
+        actions = self.stateMachine.getActionsAndUpdateState(prompts)
 
         if Fisher.LOG and self.stateMachine.state is FisherState.PRE:
             # use as reset point for run data
@@ -383,23 +394,25 @@ class Fisher(Module):
 
         score = self.getFishCalmScore(im)
 
-        self.calmScores = np.roll(self.calmScores, 1)
-        self.calmScores[0] = score
-        
-        # lol cancel them... but for python readability and future expandability i will keep it as is
-        calmScoreSm2 = np.mean((self.calmScores[1:],self.calmScores[:-1]), axis=0)
-        calmScoreDiff = calmScoreSm2[1:] - calmScoreSm2[:-1]
+        self.calmScores.append(score)
+        self.calmScoresSm2.append(self.calmScores.mean())
+
+        # differences of the smoothed scores, newest first
+        calmScoreDiff = (self.calmScoresSm2.diff(0), self.calmScoresSm2.diff(1))
 
-        if calmScoreDiff[0] * calmScoreDiff[1] < 0:
+        if self.calmClassifier:
+            self.calmState = bool(self.calmClassifier.isCalm(self.splashScorer.normIm, self.calmScores))
+        elif calmScoreDiff[0] * calmScoreDiff[1] < 0:
             # derivative changed signs
-            if calmScoreDiff[0] > 0:
+            if calmScoreDiff[0] < 0:
                 # we are at a calm point
                 self.calmState = True
             else:
                 self.calmState = False
 
         if self.configWindow:
-            self.configWindow.addDrawEvent('fishCalmScorePlot', [self.calmScores, calmScoreSm2])
+            self.configWindow.addDrawEvent('fishCalmScorePlot', [self.calmScores.view(newestFirst=True).copy(),
+                                                                 self.calmScoresSm2.view(newestFirst=True).copy()])
 
         if Fisher.LOG:
             self.dataCollector.log('time', time())
@@ -412,50 +425,64 @@ class Fisher(Module):
     def getFishCalmScore(self, im):
 
         im = im[::Fisher.SKIP,::Fisher.SKIP]
-        gray_im = cv2.cvtColor(im,cv2.COLOR_BGR2GRAY)
-        gray_im = gray_im.astype(np.float32) / 255
 
+        H,W = im.shape[:2]
+        cT, cB, cL, cR = self.getSplashCrop(H, W)
+
+        # only the splash crop is converted and filtered
+        score = self.splashScorer.update(im[ cT:H-cB , cL:W-cR ])
+
+        if Fisher.LOG:
+            pad = Fisher.LOG_PAD
+            splash_im_nn = cv2.cvtColor(im[ cT-pad:H-cB+pad , cL-pad:W-cR+pad ], cv2.COLOR_BGR2GRAY)
+            self.dataCollector.log('im', splash_im_nn.astype(np.float32) / 255)
+        if self.configWindow:
+            # image events are copied into shared memory right away, no copies needed
+            if self.configWindow.wantsImage('splashImRaw'):
+                self.configWindow.addDrawEvent('splashImRaw', self.splashScorer.splashIm)
+
+            # draw the crop on the frame at the size of its content box
+            bbSize = None
+            if self.configWindow.wantsImage('splashBoundingBox'):
+                bbSize = self.configWindow.getContentBoxSize('splashBoundingBox')
+            if bbSize is not None:
+                bbH, bbW = bbSize
+                sY, sX = bbH / H, bbW / W
+                splash_bb_im = cv2.resize(im, (bbW,bbH), interpolation=cv2.INTER_NEAREST)
+                cv2.rectangle(splash_bb_im, (int(cL*sX),int(cT*sY)), (int((W-cR)*sX),int((H-cB)*sY)), (0,0,255), thickness=5)
+                self.configWindow.addDrawEvent('splashBoundingBox', splash_bb_im)
+
+            if self.configWindow.wantsImage('splashImThresh'):
+                conv_im = self.splashScorer.convIm
+                self.calmPxMax.append(np.max(conv_im))
+                calmNormIm = conv_im / ( 1e-9 + self.calmPxMax.max())
+                self.configWindow.addDrawEvent('splashImThresh', calmNormIm)
+
+        return score
+
+    # margins (top, bottom, left, right) of the splash crop in a downsampled frame
+    def getSplashCrop(self, H, W):
         L = 0.46
         R = 0.46
         T = 0.50
         B = 0.38
 
-        H,W = gray_im.shape
-        cT = int(T*H)
-        cB = int(B*H)
-        cL = int(L*W)
-        cR = int(R*W)
-
-        splash_im = gray_im[ cT:-cB , cL:-cR ]
+        return int(T*H), int(B*H), int(L*W), int(R*W)
 
-        if Fisher.LOG:
-            pad = 50
-            splash_im_nn = gray_im[ cT-pad:-cB+pad , cL-pad:-cR+pad]
-            self.dataCollector.log('im', splash_im_nn)
+    def requiredRegions(self, frameSize):
         if self.configWindow:
-            self.configWindow.addDrawEvent('splashImRaw',splash_im)
-        
-            splash_bb_im = im.copy()
-            cv2.rectangle(splash_bb_im, (cL,cT), (W-cR,H-cB), (0,0,255), thickness=5)
-            self.configWindow.addDrawEvent('splashBoundingBox', splash_bb_im)
-            
-        if self.splashMean is None:
-            # initialize
-            self.splashMean = splash_im
-        
-        norm_im = np.clip(splash_im - self.splashMean, 0, 1)
-        self.splashMean = (1/self.bufferLength) * splash_im + (1 - 1/self.bufferLength) * self.splashMean
-        
-        # convolve to find splotches of white (splash in water)
-        conv_im = convolve2d(norm_im,self.splashConvFilter,mode='valid')
-        
-        if self.configWindow:
-            self.calmPxMax = np.roll(self.calmPxMax, 1)
-            self.calmPxMax[0] = np.max(conv_im)
-            calmNormIm = conv_im / ( 1e-9 + np.max(self.calmPxMax))
-            self.configWindow.addDrawEvent('splashImThresh', calmNormIm)
+            # the splash bounding box view shows the whole frame
+            return None
 
-        score = np.sum(conv_im ** 2) ** 0.5 / np.product(conv_im.shape)
+        h, w = frameSize
+        H, W = ceil(h / Fisher.SKIP), ceil(w / Fisher.SKIP)
+        cT, cB, cL, cR = self.getSplashCrop(H, W)
+        pad = Fisher.LOG_PAD if Fisher.LOG else 0
 
-        return score
+        splashBB = ( (cL - pad) * Fisher.SKIP,
+                     (cT - pad) * Fisher.SKIP,
+                     (W - cR + pad) * Fisher.SKIP,
+                     (H - cB + pad) * Fisher.SKIP )
+
+        return self.optionsGetter.requiredRegions(frameSize) + [splashBB]
         
\ No newline at end of file
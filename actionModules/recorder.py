@@ -1,42 +1,149 @@
 import os
+from queue import Empty
+from threading import Thread
+from time import perf_counter, time
 
 import cv2
 
+from rdr2_ai import config
 from rdr2_ai.module import Module
+from rdr2_ai.utils.pipeline import DroppingQueue, LatestQueue
 
 
 class Recorder(Module):
 
+    # frames are handed to a background encoder through a bounded queue and
+    # written as video segments (segment_K.avi) next to an index.csv of
+    # frame,segment,position,time. a full queue drops frames (see
+    # config.recordDropPolicy) instead of slowing down the main loop.
+    # replay with ReplayCapture(recordDir)
+
+    INDEX_FILE = 'index.csv'
+    REPORT_PERIOD = 5
+
     def __init__(self, recordDir, replace=True):
         self.recordDir = os.path.join('.', 'debug_ims', recordDir)
         if not os.path.isdir(self.recordDir):
             os.mkdir(self.recordDir)
-        
-        self.delim = '_'
+
+        self.indexPath = os.path.join(self.recordDir, Recorder.INDEX_FILE)
 
         self.frameIndex = 0
+        self.segmentIndex = 0
         if not replace:
-            for file in os.listdir(self.recordDir):
-                try:
-                    fnum = int(file.rstrip('.jpg').split(self.delim)[-1])
-                    self.frameIndex = max(fnum, self.frameIndex)
-                except:
-                    pass
-            self.frameIndex += 1
-    
-    def cleanup(self):
-        pass
+            # continue after the last indexed frame, in a new segment
+            lastFrame, lastSegment = Recorder.readIndexEnd(self.indexPath)
+            self.frameIndex = lastFrame + 1
+            self.segmentIndex = lastSegment + 1
+        elif os.path.exists(self.indexPath):
+            os.remove(self.indexPath)
 
-    def getActions(self, frame):
-        filename = 'frame'
-        filename += self.delim + str(self.frameIndex)
-        filename += '.jpg'
-        
-        filepath = os.path.join(self.recordDir, filename)
-        cv2.imwrite(filepath, frame)
+        if config.recordDropPolicy == 'oldest':
+            self.queue = LatestQueue(maxsize=config.recordQueueSize)
+        else:
+            self.queue = DroppingQueue(maxsize=config.recordQueueSize)
+        self.numOffered = 0
+        self.numWritten = 0
+
+        self.startTime = None
+        self.lastReportTime = None
 
-        self.print('saved frame')
+        self.encoder = Thread(target=self.encoderLoop, daemon=True)
+        self.encoder.start()
 
+    @staticmethod
+    def readIndexEnd(indexPath):
+        # (last frame, last segment) from the tail of the index, (-1, -1) if empty
+        if not os.path.exists(indexPath):
+            return -1, -1
+
+        with open(indexPath, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 256))
+            lines = f.read().decode().strip().splitlines()
+
+        if not lines or not lines[-1][0].isdigit():
+            return -1, -1
+        frame, segment = lines[-1].split(',')[:2]
+        return int(frame), int(segment)
+
+    def getActions(self, frame):
+        now = time()
+        if self.startTime is None:
+            self.startTime = perf_counter()
+            self.lastReportTime = self.startTime
+
+        # capture returns a new array every frame, no copy needed
+        self.numOffered += 1
+        self.queue.put((self.frameIndex, now, frame))
         self.frameIndex += 1
 
-        return [], True
\ No newline at end of file
+        if perf_counter() - self.lastReportTime > Recorder.REPORT_PERIOD:
+            self.print(self.summary())
+            self.lastReportTime = perf_counter()
+
+        return []
+
+    def encoderLoop(self):
+        fourcc = cv2.VideoWriter_fourcc(*config.recordFourcc)
+        writer = None
+        writerSize = None
+        position = 0
+
+        indexFile = open(self.indexPath, 'a')
+        if indexFile.tell() == 0:
+            indexFile.write('frame,segment,position,time\n')
+
+        while True:
+            # write everything that is queued, then flush the index once
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.getNowait())
+                except Empty:
+                    break
+
+            done = False
+            for item in batch:
+                if item is None:
+                    done = True
+                    break
+
+                frameIndex, frameTime, frame = item
+                h, w = frame.shape[:2]
+                if writer is not None and (position >= config.recordSegmentFrames or (w, h) != writerSize):
+                    writer.release()
+                    writer = None
+                    self.segmentIndex += 1
+                if writer is None:
+                    segmentPath = os.path.join(self.recordDir, f'segment_{self.segmentIndex}.avi')
+                    writer = cv2.VideoWriter(segmentPath, fourcc, config.recordFps, (w, h))
+                    writerSize = (w, h)
+                    position = 0
+
+                writer.write(frame)
+                indexFile.write(f'{frameIndex},{self.segmentIndex},{position},{frameTime:.4f}\n')
+                position += 1
+                self.numWritten += 1
+
+            indexFile.flush()
+            if done:
+                break
+
+        if writer is not None:
+            writer.release()
+        indexFile.close()
+
+    def summary(self):
+        if self.startTime is None:
+            return 'no frames recorded'
+        elapsed = max(perf_counter() - self.startTime, 1e-9)
+        return (f'offered {self.numOffered / elapsed:.1f} frames/s, '
+                f'recorded {self.numWritten / elapsed:.1f} frames/s '
+                f'({self.numWritten} written, {self.queue.numDropped} dropped)')
+
+    def cleanup(self):
+        # finish what is queued, the end marker must not be dropped
+        self.queue.queue.put(None)
+        self.encoder.join()
+        self.print(self.summary())
@@ -0,0 +1,83 @@
+import os
+
+import cv2
+import numpy as np
+
+from rdr2_ai import config
+from rdr2_ai.module import Module
+
+
+class CalmClassifier(Module):
+
+    # logistic regression on the splash of the current frame and the recent
+    # calm scores. features are the SplashScorer difference image (new white
+    # water) downsampled to IM_SIZE, plus the latest HISTORY scores and their
+    # differences. trained offline by data/calmTrainer.py
+
+    IM_SIZE = (6, 10) # (h, w)
+    HISTORY = 8
+
+    def __init__(self, modelPath: str = None):
+        self.modelPath = modelPath if modelPath is not None else config.calmModelPath
+
+        numFeatures = CalmClassifier.numFeatures()
+        self.weights = np.zeros(numFeatures, dtype=np.float32)
+        self.bias = 0.0
+        self.featureMean = np.zeros(numFeatures, dtype=np.float32)
+        self.featureStd = np.ones(numFeatures, dtype=np.float32)
+        self.threshold = 0.5
+
+        self.featureBuffer = np.empty(numFeatures, dtype=np.float32)
+
+    @staticmethod
+    def numFeatures():
+        h, w = CalmClassifier.IM_SIZE
+        H = CalmClassifier.HISTORY
+        return h * w + H + (H - 1)
+
+    def exists(self):
+        return os.path.exists(self.modelPath)
+
+    def load(self):
+        data = np.load(self.modelPath)
+        self.weights = data['weights'].astype(np.float32)
+        self.bias = float(data['bias'])
+        self.featureMean = data['featureMean'].astype(np.float32)
+        self.featureStd = data['featureStd'].astype(np.float32)
+        self.threshold = float(data['threshold'])
+        self.print(f'loaded calm model from {self.modelPath}.')
+        return self
+
+    def save(self):
+        # np.savez would append .npz to other paths, load() reads modelPath as is
+        with open(self.modelPath, 'wb') as f:
+            np.savez(f,
+                     weights=self.weights,
+                     bias=self.bias,
+                     featureMean=self.featureMean,
+                     featureStd=self.featureStd,
+                     threshold=self.threshold)
+        self.print(f'saved calm model to {self.modelPath}.')
+
+    # normIm: SplashScorer.normIm, calmScores: TimeSeries of scores
+    def features(self, normIm, calmScores, out=None):
+        if out is None:
+            out = np.empty(CalmClassifier.numFeatures(), dtype=np.float32)
+
+        h, w = CalmClassifier.IM_SIZE
+        H = CalmClassifier.HISTORY
+        out[:h*w] = cv2.resize(normIm, (w, h), interpolation=cv2.INTER_AREA).ravel()
+
+        scores = calmScores.view(newestFirst=True)[:H]
+        out[h*w:h*w+H] = scores
+        out[h*w+H:] = scores[:-1] - scores[1:]
+
+        return out
+
+    def probability(self, features):
+        z = np.dot(self.weights, (features - self.featureMean) / self.featureStd) + self.bias
+        return 1 / (1 + np.exp(-z))
+
+    def isCalm(self, normIm, calmScores):
+        features = self.features(normIm, calmScores, out=self.featureBuffer)
+        return self.probability(features) > self.threshold
@@ -1,19 +1,127 @@
+from dataclasses import dataclass
 from math import sqrt
+from time import perf_counter
 
 import numpy as np
 import cv2
 
+from rdr2_ai import config
 from rdr2_ai.configWindow.configWindow import ConfigWindow
-from rdr2_ai.utils.utils import (applyBBox, dilate, erode,
-                                 minKernelDifference2D, saveDebugIm)
+from rdr2_ai.module import Module
+from rdr2_ai.utils.fps import LatencyCounter
+from rdr2_ai.utils.utils import applyBBox, minKernelSSD2D, saveDebugIm
+
+
+class MinimapTracker(Module):
+
+    # searches only a window around the last location (moved by the last
+    # displacement when predicting velocity). falls back to a full search
+    # without a confident last location or when the window search is not
+    # confident. search(im) -> ((row, col), confidence in [0,1]), margin is
+    # the (h, w) the searched pattern reaches out from its location.
+    # a window result has to reach minConfidence and relConfidence times the
+    # confidence of the last full search, a wrong patch next to a lost
+    # pattern can still score well above the floor
+
+    def __init__(self, name: str, search, margin,
+                       window: int = None,
+                       minConfidence: float = None,
+                       relConfidence: float = None,
+                       predictVelocity: bool = None):
+        self.name = name
+        self.search = search
+        self.margin = margin
+        self.window = window if window is not None else config.minimapTrackWindow
+        self.minConfidence = minConfidence if minConfidence is not None else config.minimapTrackMinConfidence
+        self.relConfidence = relConfidence if relConfidence is not None else config.minimapTrackRelConfidence
+        self.predictVelocity = predictVelocity if predictVelocity is not None else config.minimapTrackVelocity
+
+        self.reset()
+
+        self.latency = LatencyCounter(f'{name} search')
+        self.numSearches = 0
+        self.numFullSearches = 0
+        self.totalSearchArea = 0
+        self.lastSearchArea = 0
+
+    def reset(self):
+        self.loc = None
+        self.confidence = 0.0
+        self.fullConfidence = 0.0 # of the last full search
+        self.velocity = np.zeros(2, dtype=int)
+
+    def track(self, im):
+        startTime = perf_counter()
+
+        loc, confidence = None, 0.0
+        if self.loc is not None and self.confidence >= self.minConfidence:
+            loc, confidence = self.searchWindow(im)
+
+        if confidence >= max(self.minConfidence, self.relConfidence * self.fullConfidence):
+            loc = np.array(loc)
+            if self.predictVelocity:
+                self.velocity = loc - self.loc
+        else:
+            loc, confidence = self.search(im)
+            loc = np.array(loc)
+            self.fullConfidence = confidence
+            self.lastSearchArea = im.shape[0] * im.shape[1]
+            self.numFullSearches += 1
+            # possibly a different blob, start over
+            self.velocity[:] = 0
+
+        self.loc, self.confidence = loc, confidence
+
+        self.numSearches += 1
+        self.totalSearchArea += self.lastSearchArea
+        self.latency.add(perf_counter() - startTime)
+
+        return tuple(int(x) for x in loc)
+
+    def searchWindow(self, im):
+        H, W = im.shape[:2]
+        mH, mW = self.margin
+        r, c = self.loc + self.velocity
+
+        r1, r2 = max(0, r - self.window - mH), min(H, r + self.window + mH + 1)
+        c1, c2 = max(0, c - self.window - mW), min(W, c + self.window + mW + 1)
+        if r2 - r1 <= 2 * mH + 1 or c2 - c1 <= 2 * mW + 1:
+            # window left the image
+            return None, 0.0
+
+        self.lastSearchArea = (r2 - r1) * (c2 - c1)
+        (lr, lc), confidence = self.search(im[r1:r2, c1:c2])
+        return (lr + r1, lc + c1), confidence
+
+    def summary(self):
+        if self.numSearches == 0:
+            return f'{self.name}: no searches'
+        return (f'{self.latency.summary()}, mean area {self.totalSearchArea / self.numSearches:.0f}px, '
+                f'{self.numFullSearches}/{self.numSearches} full searches')
+
+
+@dataclass
+class MinimapBuffers:
+    # per minimap crop size
+    validMask: np.ndarray # 255 inside the minimap circle
+    blackMask: np.ndarray
+    erodedMask: np.ndarray
 
 
 class MinimapReader:
 
+    BLACK_MAX = 3 # per channel, black blob pixels
+    MORPH_KERNEL = np.ones((3,3), np.uint8)
+    MORPH_ITERATIONS = 2
+
     def __init__(self, configWindow=None):
         self.configWindow: ConfigWindow = configWindow
         self.minimapBB = None
 
+        # geometry per frame size, masks and buffers per crop size
+        self.minimapBBs = {}
+        self.buffers = {}
+
         D = 8
         P = 12
         self.isolatedCircleKernel = np.zeros((D+2*P,D+2*P))
@@ -27,13 +135,35 @@ class MinimapReader:
 
         self.targetIcon = cv2.imread('./images/target_icon.png')
 
+        # the kernel is mostly padding, an empty patch scores sum(kernel**2)
+        self.isolatedCircleEnergy = np.sum(self.isolatedCircleKernel ** 2)
+
+        self.choreTracker = None
+        self.targetTracker = None
+        if config.minimapTracking:
+            kH, kW = self.isolatedCircleKernel.shape
+            self.choreTracker = MinimapTracker('chore', self.searchChorePoint, (kH//2, kW//2))
+            # only the target modes need the icon
+            if self.targetIcon is not None:
+                tH, tW = self.targetIcon.shape[:2]
+                self.targetTracker = MinimapTracker('target', self.searchTargetPoint, (tH//2 + 1, tW//2 + 1))
+
+    def cleanup(self):
+        for tracker in (self.choreTracker, self.targetTracker):
+            if tracker is not None:
+                tracker.print(tracker.summary())
+
+    # debug images are only built if someone is going to look at them
+    def shouldDraw(self, name):
+        return self.configWindow is not None and self.configWindow.wantsImage(name)
+
     def isolateMinimap(self, frame):
         # crop frame
-        if self.minimapBB is None:
-            self.updateMinimapBB(frame)
+        self.updateMinimapBB(frame)
         minimapIm = applyBBox(frame, self.minimapBB)
 
-        self.configWindow.addDrawEvent('rawMinimap', minimapIm)
+        if self.shouldDraw('rawMinimap'):
+            self.configWindow.addDrawEvent('rawMinimap', minimapIm)
 
         return minimapIm
 
@@ -50,30 +180,63 @@ class MinimapReader:
     def getChorePoint(self, frame):
         return self.getPossibleChorePoint(self.isolateMinimap(frame))
 
-    def getPossibleChorePoint(self, minimapIm):
+    def getBuffers(self, cropSize):
+        buffers = self.buffers.get(cropSize)
+        if buffers is None:
+            h, w = cropSize
+            validMask = np.zeros((h, w), dtype=np.uint8)
+            cv2.circle(validMask, (w//2, h//2), min(h, w)//2, 255, -1)
+            buffers = MinimapBuffers(validMask,
+                                     np.empty((h, w), dtype=np.uint8),
+                                     np.empty((h, w), dtype=np.uint8))
+            self.buffers[cropSize] = buffers
+        return buffers
+
+    # 255 on black blobs inside the minimap circle. the returned array is
+    # reused by the next call
+    def getBlackMask(self, minimapIm):
+        buffers = self.getBuffers(minimapIm.shape[:2])
+
         # only consider black blobs
-        blackMask = 255 * np.all(np.isclose(minimapIm, 0, atol=3), axis=2).astype(np.uint8)
-        blackMask = dilate(erode(blackMask, i=2), i=2)
-        blackMask = 255 * (blackMask > 127).astype(np.uint8)
+        B = MinimapReader.BLACK_MAX
+        cv2.inRange(minimapIm[:,:,:3], (0,0,0), (B,B,B), dst=buffers.blackMask)
+        cv2.bitwise_and(buffers.blackMask, buffers.validMask, dst=buffers.blackMask)
+
+        # opening, the mask stays binary
+        cv2.erode(buffers.blackMask, MinimapReader.MORPH_KERNEL, dst=buffers.erodedMask,
+                  iterations=MinimapReader.MORPH_ITERATIONS)
+        cv2.dilate(buffers.erodedMask, MinimapReader.MORPH_KERNEL, dst=buffers.blackMask,
+                   iterations=MinimapReader.MORPH_ITERATIONS)
+
+        return buffers.blackMask
+
+    def getPossibleChorePoint(self, minimapIm):
+        blackMask = self.getBlackMask(minimapIm)
         
-        saveDebugIm(blackMask, desc='blackmask')
+        if config.saveDebugIms:
+            saveDebugIm(blackMask, desc='blackmask')
 
         # find best dot
-        score, loc = minKernelDifference2D(blackMask, self.isolatedCircleKernel)
+        if self.choreTracker is not None:
+            loc = self.choreTracker.track(blackMask)
+        else:
+            loc, _ = self.searchChorePoint(blackMask)
 
-        # draw in config
         cv2Loc = np.array(loc[::-1])
-        playerLoc = np.array(self.getCenterPoint())
-        lineVec = cv2Loc - playerLoc
-        unitLineVec = lineVec / sqrt(lineVec[0]**2 + lineVec[1]**2)
 
-        targetIm = np.zeros((*blackMask.shape, 3))
-        for c in range(3):
-            targetIm[:,:,c] = blackMask
+        # draw in config
+        if self.shouldDraw('target'):
+            playerLoc = np.array(self.getCenterPoint())
+            lineVec = cv2Loc - playerLoc
+            unitLineVec = lineVec / max(1e-9, sqrt(lineVec[0]**2 + lineVec[1]**2))
 
-        cv2.circle(targetIm, cv2Loc, 10, (0,0,255), 3)
-        lineEnd = (cv2Loc - 25*unitLineVec).astype(int)
-        cv2.line(targetIm, playerLoc, lineEnd, (0,255,0), 3)
+            targetIm = cv2.cvtColor(blackMask, cv2.COLOR_GRAY2BGR)
+
+            cv2.circle(targetIm, cv2Loc, 10, (0,0,255), 3)
+            lineEnd = (cv2Loc - 25*unitLineVec).astype(int)
+            cv2.line(targetIm, playerLoc, lineEnd, (0,255,0), 3)
+
+            self.configWindow.addDrawEvent('target', targetIm)
 
         # dotIm = np.zeros_like(minimapIm)
         # cnts = cv2.findContours(blackMask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -89,10 +252,22 @@ class MinimapReader:
         #         cY = int(moments['m01'] / moments['m00'])
         #         pts.append((cX, cY))
         
-        self.configWindow.addDrawEvent('target', targetIm)
-        
         return cv2Loc
 
+    # (row, col) of the best dot and how sure we are
+    def searchChorePoint(self, blackMask):
+        # both are 0/255
+        score, loc = minKernelSSD2D(blackMask, self.isolatedCircleKernel, scale=255)
+        confidence = max(0.0, 1 - score / self.isolatedCircleEnergy)
+        return loc, confidence
+
+    # (row, col) of the target icon center and how sure we are
+    def searchTargetPoint(self, minimapIm):
+        res = cv2.matchTemplate(minimapIm, self.targetIcon, cv2.TM_SQDIFF_NORMED)
+        minVal, _, (x, y), _ = cv2.minMaxLoc(res)
+        h, w = self.targetIcon.shape[:2]
+        return (y + h//2, x + w//2), max(0.0, 1 - minVal)
+
     def getTargetPoint(self, frame):
         minimapImage = self.isolateMinimap(frame)
         possibleTargetPoint = self.getPossibleTargetPoint(minimapImage)
@@ -100,28 +275,45 @@ class MinimapReader:
 
     def getPossibleTargetPoint(self, minimapIm):
         
-        res = cv2.matchTemplate(minimapIm, self.targetIcon, cv2.TM_SQDIFF_NORMED)
-        _, _, loc, _ = cv2.minMaxLoc(res)
+        if self.targetTracker is not None:
+            y, x = self.targetTracker.track(minimapIm)
+        else:
+            (y, x), _ = self.searchTargetPoint(minimapIm)
+
+        h, w = self.targetIcon.shape[:2]
+        topLeft = (x - w//2, y - h//2)
+        bottomRight = (topLeft[0] + w, topLeft[1] + h)
 
-        topLeft = loc
-        bottomRight = (loc[0] + self.targetIcon.shape[1], loc[1] + self.targetIcon.shape[0])
+        targetLoc = np.array((x, y))
 
-        targetLoc = np.array(((topLeft[0] + bottomRight[0])//2, (topLeft[1] + bottomRight[1])//2))
-        playerLoc = np.array(self.getCenterPoint())
+        if self.shouldDraw('target'):
+            playerLoc = np.array(self.getCenterPoint())
 
-        lineVec = targetLoc - playerLoc
-        unitLineVec = lineVec / sqrt(lineVec[0]**2 + lineVec[1]**2)
-        lineEnd = (targetLoc - 25*unitLineVec).astype(int)
+            lineVec = targetLoc - playerLoc
+            unitLineVec = lineVec / max(1e-9, sqrt(lineVec[0]**2 + lineVec[1]**2))
+            lineEnd = (targetLoc - 25*unitLineVec).astype(int)
 
-        targetIm = minimapIm.copy()
-        cv2.rectangle(targetIm, topLeft, bottomRight, (0,0,255), 3)
-        cv2.line(targetIm, playerLoc, lineEnd, (0,255,0), 3)
-        self.configWindow.addDrawEvent('target', targetIm)
+            targetIm = minimapIm.copy()
+            cv2.rectangle(targetIm, topLeft, bottomRight, (0,0,255), 3)
+            cv2.line(targetIm, playerLoc, lineEnd, (0,255,0), 3)
+            self.configWindow.addDrawEvent('target', targetIm)
 
         return targetLoc
 
+    def requiredRegions(self, frameSize):
+        return [self.getMinimapBB(frameSize)]
+
     def updateMinimapBB(self, frame):
-        h, w = frame.shape[:2]
+        self.minimapBB = self.getMinimapBB(frame.shape[:2])
+
+    def getMinimapBB(self, frameSize):
+        frameSize = tuple(frameSize)
+        if frameSize not in self.minimapBBs:
+            self.minimapBBs[frameSize] = self.computeMinimapBB(frameSize)
+        return self.minimapBBs[frameSize]
+
+    def computeMinimapBB(self, frameSize):
+        h, w = frameSize
         mmSize = 440
         hScale, wScale = h/1417, w/3440
 
@@ -130,4 +322,4 @@ class MinimapReader:
         x2 = x1 + int(mmSize * hScale)
         y2 = y1 + int(mmSize * hScale) # im assuming minimap scales with height?
 
-        self.minimapBB = (x1, y1, x2, y2)
+        return (x1, y1, x2, y2)
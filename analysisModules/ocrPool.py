@@ -0,0 +1,81 @@
+from queue import Queue
+from threading import Thread
+
+from PIL import Image
+from tesserocr import PyTessBaseAPI, PSM
+
+from rdr2_ai import config
+from rdr2_ai.module import Module
+
+
+class TesseractPool(Module):
+
+    # one PyTessBaseAPI per worker thread, each only ever used by its own
+    # thread. tesseract releases the gil while recognizing, so the strips of
+    # a frame are ocr'd in parallel
+
+    def __init__(self, size: int = 1):
+        self.size = max(1, size)
+        self.tasks = Queue()
+
+        # pay the tesseract startup cost once, up front
+        readyQueue = Queue()
+        self.workers = [Thread(target=self.workerLoop, args=(readyQueue,), daemon=True)
+                        for _ in range(self.size)]
+        for worker in self.workers:
+            worker.start()
+        for _ in self.workers:
+            error = readyQueue.get()
+            if error is not None:
+                self.cleanup()
+                raise error
+
+        self.print(f'started {self.size} tesseract workers.')
+
+    # errors are passed back to the waiting thread, a worker that died
+    # silently would leave recognize waiting forever
+    def workerLoop(self, readyQueue):
+        try:
+            tesseractAPI = PyTessBaseAPI(path=config.tessdataPath,
+                                         psm=PSM.SINGLE_LINE)
+        except Exception as e:
+            readyQueue.put(e)
+            return
+        readyQueue.put(None)
+
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+
+            index, pilImage, results = task
+            try:
+                tesseractAPI.SetImage(pilImage)
+                results.put((index, tesseractAPI.GetUTF8Text()))
+            except Exception as e:
+                results.put((index, e))
+
+        tesseractAPI.End()
+
+    # texts of all images, in order. raises the first error of a worker
+    def recognize(self, images):
+        results = Queue()
+        for index, image in enumerate(images):
+            self.tasks.put((index, Image.fromarray(image), results))
+
+        texts = [None] * len(images)
+        for _ in images:
+            index, text = results.get()
+            texts[index] = text
+
+        for text in texts:
+            if isinstance(text, Exception):
+                raise text
+
+        return texts
+
+    def cleanup(self):
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
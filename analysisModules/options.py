@@ -1,21 +1,19 @@
-from os.path import join
+from hashlib import blake2b
+from math import ceil
 
 import cv2
 import numpy as np
-import matplotlib
-import matplotlib.pyplot as plt
 # import pytesseract
 # from pytesseract import Output
-from PIL import Image
-from tesserocr import PyTessBaseAPI, PSM
-from spellchecker.spellchecker import SpellChecker
 
 from rdr2_ai import config
 from rdr2_ai.configWindow.configWindow import ConfigWindow
 from rdr2_ai.module import Module
-from rdr2_ai.utils.utils import applyBBox, dilate, segmentImage
-
-matplotlib.use('Agg')
+from rdr2_ai.analysisModules.ocrPool import TesseractPool
+from rdr2_ai.analysisModules.prompts import PromptTemplateRecognizer
+from rdr2_ai.utils.cache import LRUCache
+from rdr2_ai.utils.spelling import getSpellChecker
+from rdr2_ai.utils.utils import applyBBox, dilate
 
 class OptionsGetter(Module):
 
@@ -24,7 +22,11 @@ class OptionsGetter(Module):
 
     RES_SKIP = 1
 
-    def __init__(self, configWindow: ConfigWindow, showInConfigWindow: bool = False, timeSkip: int = 1):
+    def __init__(self, configWindow: ConfigWindow,
+                       showInConfigWindow: bool = False,
+                       timeSkip: int = 1,
+                       detectChanges: bool = None,
+                       recognizer: str = 'tesseract'):
         self.optionsOffsetBR = config.optionsOffsetBR
         self.craftingScoreThreshold = config.craftingScoreThreshold
         self.textColorTolerance = config.textColorTolerance
@@ -36,35 +38,77 @@ class OptionsGetter(Module):
         self.minHorLineHeight = config.minHorLineHeight
         self.horLineCoverageThresh = config.horLineCoverageThresh
         self.spellcheckDistance = config.spellcheckDistance
+        self.OCRCacheHash = config.OCRCacheHash
         
         self.timeSkip = timeSkip
         self.currOptions = None
         self.frameIndex = 0
 
+        # adaptive mode: only rerun ocr when the options box changed
+        if detectChanges is None:
+            detectChanges = config.optionsChangeDetection
+        self.detectChanges = detectChanges
+        self.changeSignatureScale = config.optionsChangeSignatureScale
+        self.changePixelThresh = config.optionsChangePixelThresh
+        self.changeMinPixels = config.optionsChangeMinPixels
+        self.changeMaxSkip = config.optionsChangeMaxSkip
+        self.lastSignature = None
+        self.numSkipped = 0
+        self.numSinceRefresh = 0
+
         self.winSize = None
         self.optionsBB = None
 
+        # reused across frames
+        self.optionsFrameBin = None
+        self.textLowerBound = (0, 0, 0)
+        self.textUpperBound = (254 - self.textColorTolerance,) * 3
+
         self.configWindow = configWindow
         self.showInConfigWindow = showInConfigWindow
 
-        self.spellcheck = SpellChecker(distance=self.spellcheckDistance)
+        # prompt words only, shared by every OptionsGetter
+        self.spellcheck = getSpellChecker()
+
+        # strips of one frame are ocr'd in parallel
+        self.ocrPool = TesseractPool(size=config.OCRPoolSize)
 
-        self.tesseractAPI = PyTessBaseAPI(path=join("C:\\Project\\tessdata\\"),
-                                          psm=PSM.SINGLE_LINE)
+        # 'tesseract' or 'template'. template falls back to tesseract on strips it is unsure about
+        self.recognizer = recognizer
+        self.promptRecognizer = PromptTemplateRecognizer() if recognizer == 'template' else None
+
+        # option strip hash -> cleaned text, prompts barely change between frames
+        self.ocrCache = LRUCache(maxSize=config.OCRCacheSize, name='ocrCache')
     
     def cleanup(self):
-        self.tesseractAPI.End()
+        self.ocrPool.cleanup()
+        self.print(self.ocrCache.summary())
+        self.print(self.spellcheck.corrections.summary())
+        if self.detectChanges:
+            self.print(f'skipped {self.numSkipped}/{self.frameIndex} unchanged frames ({100*self.skipRatio():.1f}%)')
 
     def updateBoundingBoxes(self, frame):
         self.winSize = (frame.shape[1], frame.shape[0])
-        self.optionsBB = ( self.winSize[0] - self.optionsOffsetBR[0],
-                           self.winSize[1] - self.optionsOffsetBR[1],
-                           self.winSize[0],
-                           self.winSize[1] )
+        self.optionsBB = self.getOptionsBB(frame.shape[:2])
+
+    def getOptionsBB(self, frameSize):
+        h, w = frameSize
+        return ( w - self.optionsOffsetBR[0],
+                 h - self.optionsOffsetBR[1],
+                 w,
+                 h )
+
+    def requiredRegions(self, frameSize):
+        return [self.getOptionsBB(frameSize)]
 
 
     def getOptions(self, frame):
-        if self.frameIndex % self.timeSkip == 0:
+        if self.detectChanges:
+            if self.optionsChanged(frame):
+                self.currOptions = self.getOptionsFromFrame(frame)
+            else:
+                self.numSkipped += 1
+        elif self.frameIndex % self.timeSkip == 0:
             self.currOptions = self.getOptionsFromFrame(frame)
         self.frameIndex += 1
 
@@ -72,6 +116,33 @@ class OptionsGetter(Module):
 
         return self.currOptions
 
+    def optionsChanged(self, frame):
+        if self.optionsBB is None or self.winSize is None:
+            self.updateBoundingBoxes(frame)
+
+        # cheap downsampled signature of the options box
+        optionsFrame = applyBBox(frame, self.optionsBB)
+        signature = cv2.resize(optionsFrame, (0,0),
+                               fx=self.changeSignatureScale,
+                               fy=self.changeSignatureScale,
+                               interpolation=cv2.INTER_AREA)
+
+        changed = (self.currOptions is None or
+                   self.lastSignature is None or
+                   self.lastSignature.shape != signature.shape or
+                   self.numSinceRefresh >= self.changeMaxSkip)
+        if not changed:
+            numChangedPx = np.count_nonzero(cv2.absdiff(signature, self.lastSignature) > self.changePixelThresh)
+            changed = numChangedPx >= self.changeMinPixels
+
+        self.lastSignature = signature
+        self.numSinceRefresh = 0 if changed else self.numSinceRefresh + 1
+
+        return changed
+
+    def skipRatio(self):
+        return self.numSkipped / self.frameIndex if self.frameIndex else 0.0
+
     """
     def getCraftingInfo(self,frame):
 
@@ -123,52 +194,97 @@ class OptionsGetter(Module):
 
     def getOptionsFromFrame(self, frame):
         
+        # binarized strip of each option
+        optionFramesList = self.getOptionStrips(frame)
+
+        # do ocr on each option frame
+        optionWords = self.wordsFromFrames(optionFramesList)
+
+        return optionWords
+
+    def getOptionStrips(self, frame):
+        
         if self.optionsBB is None or self.winSize is None:
             self.updateBoundingBoxes(frame)
 
         # crop to only options area
         optionsFrame = applyBBox(frame,self.optionsBB)
-        if self.showInConfigWindow and self.configWindow:
+        if self.showInConfigWindow and self.configWindow and self.configWindow.wantsImage('optionsFrameRaw'):
             self.configWindow.addDrawEvent('optionsFrameRaw', optionsFrame)
 
-        # clean options frame for ocr
-        optionsFramePreProc = self.preprocessOptionsFrame(optionsFrame)
-        if self.showInConfigWindow and self.configWindow:
-            self.configWindow.addDrawEvent('optionsFrameClean', optionsFramePreProc)
+        # binarize at native resolution, only the strips that get ocr'd are scaled up
+        optionsFrameBin = self.binarizeOptionsFrame(optionsFrame)
+        if self.showInConfigWindow and self.configWindow and self.configWindow.wantsImage('optionsFrameClean'):
+            self.configWindow.addDrawEvent('optionsFrameClean', optionsFrameBin)
+
+        # one row profile for both line detection and segmentation
+        textRows, horLineExists = self.findOptionRows(optionsFrameBin)
 
         # detect if there is a horizontal line. if there exists one, text below
         # it is simply the name of the item that you are crafting/cooking
-        horLineExists = self.horizontalLinePresent(optionsFramePreProc)
-
-        # segment image into each seperate option
-        optionFramesList = self.segmentOptionsFrame(optionsFramePreProc)
-
-        if len(optionFramesList) > 0 and horLineExists:
-            optionFramesList = optionFramesList[:-1]
+        if len(textRows) > 0 and horLineExists:
+            textRows = textRows[:-1]
 
-        # do ocr on each option frame
-        optionWords = self.wordsFromFrames(optionFramesList)
-
-        return optionWords
-    
-    def preprocessOptionsFrame(self, optionsFrame):
-
-        # binarize image and cvt to grayscale
-        optionsFrameMaskInv = np.all(optionsFrame < (255-self.textColorTolerance),axis=2)
-        optionsFrameBin = np.zeros(optionsFrame.shape[:2],dtype=np.uint8)
-        optionsFrameBin[~optionsFrameMaskInv] = 255
-
-        # crop as tight as possible and scale up for OCR
+        # crop columns as tight as possible
         textPad = int(self.textPadding)
-        x,y,w,h = cv2.boundingRect(optionsFrameBin)
+        x,_,w,_ = cv2.boundingRect(optionsFrameBin)
         x1 = max(0,x-textPad)
-        y1 = max(0,y-textPad)
         x2 = min(optionsFrameBin.shape[1],x+w+textPad)
-        y2 = min(optionsFrameBin.shape[0],y+h+textPad)
 
-        optionsFrameCropped = optionsFrameBin[y1:y2,x1:x2]
-        optionsFrameScaled = cv2.resize(
-            optionsFrameCropped,
+        return [optionsFrameBin[y1:y2, x1:x2] for y1,y2 in textRows]
+    
+    def binarizeOptionsFrame(self, optionsFrame):
+        h, w = optionsFrame.shape[:2]
+        if self.optionsFrameBin is None or self.optionsFrameBin.shape != (h, w):
+            self.optionsFrameBin = np.empty((h, w), dtype=np.uint8)
+
+        # text is any pixel with a channel above the tolerance
+        cv2.inRange(optionsFrame, self.textLowerBound, self.textUpperBound, dst=self.optionsFrameBin)
+        cv2.bitwise_not(self.optionsFrameBin, dst=self.optionsFrameBin)
+
+        return self.optionsFrameBin
+
+    def findOptionRows(self, optionsFrameBin):
+        # the thresholds are in ocr (scaled up) pixels, so scale run heights by S
+        S = self.OCRScaleFactor
+        minLineHeight = int(self.minHorLineHeight * S / 3)
+        minTextGap = int(self.minOptionTextGap * S / 3)
+        textPad = ceil(self.textPadding / 3)
+
+        rowSum = cv2.reduce(optionsFrameBin, 1, cv2.REDUCE_SUM, dtype=cv2.CV_32S).ravel()
+        H, W = optionsFrameBin.shape
+
+        # the ocr path dilates by about a native row, which closes 1 row gaps
+        rowInk = rowSum > 0
+        rowInkDilated = rowInk.copy()
+        rowInkDilated[1:] |= rowInk[:-1]
+        rowInkDilated[:-1] |= rowInk[1:]
+
+        # runs of ink rows [start, end), runs touching the border are cut off
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], rowInkDilated.view(np.int8), [0]))))
+        starts, ends = edges[::2], edges[1::2]
+        inside = (starts > 0) & (ends < H)
+        starts, ends = starts[inside], ends[inside]
+        heights = (ends - starts) * S
+
+        horLineExists = False
+        for start, end, height in zip(starts, ends, heights):
+            if minLineHeight + 2 < height < minTextGap + 2:
+                coverage = rowSum[start:end].sum() / ((end - start) * W)
+                if coverage > self.horLineCoverageThresh:
+                    # found a line
+                    horLineExists = True
+                    break
+
+        isText = heights > minTextGap + 2
+        textRows = [(max(0, start - textPad), min(H, end + textPad))
+                    for start, end in zip(starts[isText], ends[isText])]
+
+        return textRows, horLineExists
+
+    def upscaleStrip(self, optionFrame):
+        optionFrameScaled = cv2.resize(
+            optionFrame,
             (0,0),
             fx=self.OCRScaleFactor,
             fy=self.OCRScaleFactor,
@@ -176,66 +292,65 @@ class OptionsGetter(Module):
         )
 
         # fill in holes
-        optionsFrameDilated = dilate(optionsFrameScaled)
+        return dilate(optionFrameScaled)
 
-        return optionsFrameDilated
+    def wordsFromFrames(self, optionFramesList):
+        optionFramesList = [optionFrame[::OptionsGetter.RES_SKIP , ::OptionsGetter.RES_SKIP]
+                            for optionFrame in optionFramesList]
 
-    def horizontalLinePresent(self, optionsFrame):
-        minLineHeight = int(self.minHorLineHeight * self.OCRScaleFactor / 3)
-        minTextGap = int(self.minOptionTextGap * self.OCRScaleFactor / 3)
+        # only run ocr on strips we have not seen recently
+        stripKeys = list(map(self.getStripKey, optionFramesList))
+        stripWords = [self.ocrCache.get(stripKey) for stripKey in stripKeys]
 
-        optionFramesList = segmentImage(
-            optionsFrame,
-            minGap=minLineHeight,
-            pad=0,
-            bgColor=0,
-            axis=0
-        )
+        missIndices = [i for i, words in enumerate(stripWords) if words is None]
+        missWords = self.recognizeStrips([optionFramesList[i] for i in missIndices])
+        for i, words in zip(missIndices, missWords):
+            stripWords[i] = words
+            self.ocrCache.put(stripKeys[i], words)
 
-        for frame in optionFramesList:
+        optionWordsClean = [w for words in stripWords for w in words]
+        optionWordsClean = list(filter(len,optionWordsClean))
 
-            if (frame.shape[0] < minTextGap) and (np.mean(frame) > self.horLineCoverageThresh):
-                # found a line
-                return True
-        
-        return False
+        return optionWordsClean
 
-    def segmentOptionsFrame(self, optionsFrame):
-        minGap = int(self.minOptionTextGap * self.OCRScaleFactor / 3)
-        textPad = int(self.textPadding * self.OCRScaleFactor / 3)
-        
-        optionFramesList = segmentImage(
-            optionsFrame,
-            minGap=minGap,
-            pad=textPad,
-            bgColor=0,
-            axis=0
-        )
+    # cleaned words of a single option strip
+    def recognizeStrip(self, optionFrame):
+        return self.recognizeStrips([optionFrame])[0]
 
-        return optionFramesList
-    
-    def wordsFromFrames(self, optionFramesList):
-        optionWords = []
-        for optionFrame in optionFramesList:
-            optionFrame = optionFrame[::OptionsGetter.RES_SKIP , ::OptionsGetter.RES_SKIP]
-            
-            #newOptionsWords = self.getWords_PyTesseract(optionFrame)
-            newOptionsWords = self.getWords_TesserOCR(optionFrame)
-            optionWords.extend(newOptionsWords)
-        
-        optionWordsClean = []
-        if len(optionWords) > 0:
-            optionWordsClean = list(map(self.cleanOCROutput,optionWords))
+    def recognizeStrips(self, optionFramesList):
+        stripWords = [None] * len(optionFramesList)
 
-        optionWordsClean = list(filter(len,optionWordsClean))
+        if self.promptRecognizer is not None:
+            for i, optionFrame in enumerate(optionFramesList):
+                label, _ = self.promptRecognizer.recognize(optionFrame)
+                if label is not None:
+                    stripWords[i] = [label]
 
-        return optionWordsClean
+        # everything the templates could not handle goes to tesseract
+        ocrIndices = [i for i, words in enumerate(stripWords) if words is None]
+        ocrFrames = [self.upscaleStrip(optionFramesList[i]) for i in ocrIndices]
+
+        #newOptionsWords = self.getWords_PyTesseract(optionFrame)
+        ocrWords = self.getWords_TesserOCR(ocrFrames)
+        for i, newOptionsWords in zip(ocrIndices, ocrWords):
+            stripWords[i] = list(map(self.cleanOCROutput, newOptionsWords))
+
+        return stripWords
+
+    def getStripKey(self, optionFrame):
+        if self.OCRCacheHash == 'perceptual':
+            # coarse binary thumbnail plus aspect ratio, survives a pixel of jitter
+            h, w = optionFrame.shape[:2]
+            thumb = cv2.resize(optionFrame, (64, 8), interpolation=cv2.INTER_AREA) > 127
+            return (round(4 * w / h), np.packbits(thumb).tobytes())
+
+        optionFrame = np.ascontiguousarray(optionFrame)
+        return (optionFrame.shape, blake2b(optionFrame.data, digest_size=16).digest())
     
-    def getWords_TesserOCR(self, optionFrame):
-        pilOptionFrame = Image.fromarray(optionFrame ^ 255)
-        self.tesseractAPI.SetImage(pilOptionFrame)
-        text = self.tesseractAPI.GetUTF8Text()
-        return [text]
+    # words of each option frame
+    def getWords_TesserOCR(self, optionFramesList):
+        texts = self.ocrPool.recognize([optionFrame ^ 255 for optionFrame in optionFramesList])
+        return [[text] for text in texts]
 
     # def getWords_PyTesseract(self, optionFrame):
     #     ocrData = pytesseract.image_to_data(
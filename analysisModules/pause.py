@@ -1,5 +1,6 @@
-import numpy as np
+import cv2
 
+from rdr2_ai import config
 from rdr2_ai.module import Module
 
 class PauseMenu(Module):
@@ -9,25 +10,40 @@ class PauseMenu(Module):
     PX_THRESH = 0.75
     SKIP = 10
 
-    def __init__(self):
-        pass
+    # probeGrid: (rows, cols) of pixels checked first, if less than
+    # probeMinRed of them are red the game is not paused. defaults from
+    # config, probeGrid=False always counts the whole subsample
+    def __init__(self, probeGrid=None, probeMinRed: float = None):
+        self.probeGrid = probeGrid if probeGrid is not None else config.pauseProbeGrid
+        self.probeMinRed = probeMinRed if probeMinRed is not None else config.pauseProbeMinRed
+
+        # pause menu red, inclusive bounds for cv2.inRange
+        self.redLowerBound = (0, 0, PauseMenu.RED_THRESH + 1)
+        self.redUpperBound = (PauseMenu.OTHER_THRESH - 1, PauseMenu.OTHER_THRESH - 1, 255)
+
+    def requiredRegions(self, frameSize):
+        h, w = frameSize
+        return [(0, 0, min(500, w), h)]
 
     def gameIsPaused(self, frame):
         
         # menu should take up all left 500 px
         leftFrame = frame[:   :PauseMenu.SKIP,
                           :500:PauseMenu.SKIP]
-        H, W, C = leftFrame.shape
-        leftPx = leftFrame.reshape((H * W, C))
-        
-        # get counts of unique pixels
-        pxs, cnts = np.unique(leftPx, axis=0, return_counts=True)
-        
+        H, W = leftFrame.shape[:2]
+
+        if self.probeGrid:
+            # the menu covers most of the left side, a few pixels are enough
+            # to rule it out
+            rows, cols = self.probeGrid
+            probe = leftFrame[H//(2*rows)::max(1, H//rows), W//(2*cols)::max(1, W//cols)]
+            numProbeRed = cv2.countNonZero(cv2.inRange(probe, self.redLowerBound, self.redUpperBound))
+            if numProbeRed < self.probeMinRed * probe.shape[0] * probe.shape[1]:
+                return False
+
         # get number of red pixels
-        redMask = (pxs[:,0] < PauseMenu.OTHER_THRESH) & (pxs[:,1] < PauseMenu.OTHER_THRESH) & (pxs[:,2] > PauseMenu.RED_THRESH)
-        numRedPx = np.sum(cnts[redMask])
+        numRedPx = cv2.countNonZero(cv2.inRange(leftFrame, self.redLowerBound, self.redUpperBound))
         numTotPx = H*W
 
         # if over PX_THRESH are red, then we are in the pause menu
         return (numRedPx / numTotPx) > PauseMenu.PX_THRESH
-    
\ No newline at end of file
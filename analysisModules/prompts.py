@@ -0,0 +1,154 @@
+import argparse
+import os
+
+import cv2
+import numpy as np
+
+from rdr2_ai import config
+from rdr2_ai.module import Module
+
+
+class PromptTemplateRecognizer(Module):
+
+    # classifies binarized option strips against templates of the known
+    # prompts (config.knownPrompts) by normalized cross-correlation. strips
+    # are cropped to their ink and resized to TEMPLATE_SIZE, so one matrix
+    # product scores a strip against every template
+
+    TEMPLATE_SIZE = (24, 192) # (h, w)
+    MAX_ASPECT_RATIO = 1.5 # ink aspect ratios must be within this factor
+
+    # empty: start without templates (for learning)
+    def __init__(self, templatePath: str = None,
+                       minScore: float = None,
+                       empty: bool = False):
+        self.templatePath = templatePath if templatePath is not None else config.promptTemplatesPath
+        self.minScore = minScore if minScore is not None else config.promptTemplateMinScore
+
+        self.labels = []
+        self.templates = np.zeros((0, np.prod(PromptTemplateRecognizer.TEMPLATE_SIZE)), dtype=np.float32)
+        self.aspects = np.zeros(0, dtype=np.float32)
+
+        if not empty:
+            if os.path.exists(self.templatePath):
+                self.load()
+            else:
+                self.print(f'no templates at {self.templatePath}, rendering them.')
+                self.renderTemplates(config.knownPrompts)
+
+    def load(self):
+        data = np.load(self.templatePath)
+        self.labels = list(data['labels'])
+        self.templates = data['templates']
+        self.aspects = data['aspects']
+        self.print(f'loaded {len(self.labels)} templates.')
+
+    def save(self):
+        np.savez(self.templatePath,
+                 labels=np.array(self.labels),
+                 templates=self.templates,
+                 aspects=self.aspects)
+        self.print(f'saved {len(self.labels)} templates to {self.templatePath}.')
+
+    def renderTemplates(self, prompts):
+        # rough fallback, the game font is not a hershey font
+        for prompt in prompts:
+            (w, h), base = cv2.getTextSize(prompt.title(), cv2.FONT_HERSHEY_DUPLEX, 2, 3)
+            im = np.zeros((h + base + 10, w + 10), dtype=np.uint8)
+            cv2.putText(im, prompt.title(), (5, h + 5), cv2.FONT_HERSHEY_DUPLEX, 2, 255, 3)
+            self.addTemplate(im, prompt)
+
+    def addTemplate(self, strip, label):
+        vec, aspect = self.normalizeStrip(strip)
+        if vec is None:
+            return False
+
+        self.labels.append(label)
+        self.templates = np.vstack((self.templates, vec[None]))
+        self.aspects = np.append(self.aspects, np.float32(aspect))
+        return True
+
+    def normalizeStrip(self, strip):
+        # crop to ink, fixed size, zero mean and unit norm
+        x, y, w, h = cv2.boundingRect(strip)
+        if w == 0 or h == 0:
+            return None, 0
+
+        th, tw = PromptTemplateRecognizer.TEMPLATE_SIZE
+        inkIm = cv2.resize(strip[y:y+h, x:x+w], (tw, th), interpolation=cv2.INTER_AREA)
+
+        vec = inkIm.astype(np.float32).ravel()
+        vec -= vec.mean()
+        norm = np.linalg.norm(vec)
+        if norm == 0:
+            return None, 0
+
+        return vec / norm, w / h
+
+    # returns (label, score), label is None below minScore
+    def recognize(self, strip):
+        vec, aspect = self.normalizeStrip(strip)
+        if vec is None or len(self.labels) == 0:
+            return None, 0.0
+
+        scores = self.templates @ vec
+
+        aspectRatios = np.maximum(self.aspects / aspect, aspect / self.aspects)
+        scores[aspectRatios > PromptTemplateRecognizer.MAX_ASPECT_RATIO] = -1
+
+        best = int(np.argmax(scores))
+        if scores[best] < self.minScore:
+            return None, float(scores[best])
+
+        return self.labels[best], float(scores[best])
+
+    def learnFromStrips(self, strips, labels, maxPerLabel: int = 8, novelScore: float = 0.95):
+        # keep a few distinct examples of each label, skip near duplicates
+        numAdded = 0
+        for strip, label in zip(strips, labels):
+            if label not in config.knownPrompts:
+                continue
+            if self.labels.count(label) >= maxPerLabel:
+                continue
+
+            predLabel, score = self.recognize(strip)
+            if predLabel == label and score > novelScore:
+                continue
+
+            numAdded += self.addTemplate(strip, label)
+        return numAdded
+
+
+def learnTemplates(source, templatePath=None):
+    # label the strips of a recorded session with tesseract and keep them as templates
+
+    # options imports this module
+    from rdr2_ai.analysisModules.options import OptionsGetter
+    from rdr2_ai.utils.replay import ReplayCapture
+
+    recognizer = PromptTemplateRecognizer(templatePath, empty=True)
+
+    optionsGetter = OptionsGetter(configWindow=None, detectChanges=False, recognizer='tesseract')
+    capture = ReplayCapture(source)
+
+    while (frame := capture.captureWindow()) is not None:
+        strips = optionsGetter.getOptionStrips(frame)
+        labels = [optionsGetter.recognizeStrip(strip) for strip in strips]
+        labels = [words[0] if len(words) == 1 else '' for words in labels]
+        recognizer.learnFromStrips(strips, labels)
+
+    capture.cleanup()
+    optionsGetter.cleanup()
+    recognizer.save()
+
+
+if __name__ == '__main__':
+
+    argParser = argparse.ArgumentParser(description='Learn prompt templates from a recorded session.')
+    argParser.add_argument('source', type=str,
+                           help='Recorded frame directory or video.')
+    argParser.add_argument('--out', '-o', default=None, type=str,
+                           help='Template file to write (default config.promptTemplatesPath).')
+    args = argParser.parse_args()
+
+    learnTemplates(args.source, args.out)
@@ -0,0 +1,86 @@
+import cv2
+import numpy as np
+
+from rdr2_ai.module import Module
+
+
+class SplashScorer(Module):
+
+    # how much new white water (splash) there is in the splash crop. the crop
+    # is compared to a running mean of past crops and the positive difference
+    # is filtered for splotches. all buffers are float32 and reused, they are
+    # reallocated only when the crop size changes
+
+    def __init__(self, skip: int = 2, bufferLength: int = 15):
+        self.bufferLength = bufferLength
+        self.alpha = 1 / bufferLength
+
+        # disgusting
+        KH = 10 / skip
+        KW = 15 / skip
+        filtr_o_h = np.linspace(0,1,int(KH))
+        filtr_o_w = np.linspace(0,1,int(KW))
+        filtr_h = np.append(np.append(filtr_o_h,[1]),np.flip(filtr_o_h))
+        filtr_w = np.append(np.append(filtr_o_w,[1]),np.flip(filtr_o_w))
+        filtr = np.add.outer(filtr_h,filtr_w) / 2
+        self.convFilter = (filtr ** 3).astype(np.float32)
+
+        # the filter is symmetric, so filter2D (correlation) is the convolution
+        assert np.array_equal(self.convFilter, self.convFilter[::-1,::-1])
+        self.filterH, self.filterW = self.convFilter.shape
+
+        self.shape = None
+
+    def allocate(self, shape):
+        H, W = shape
+        self.shape = shape
+        self.grayIm = np.empty((H, W), dtype=np.uint8)
+        self.splashIm = np.empty((H, W), dtype=np.float32)
+        self.splashMean = None
+        self.normIm = np.empty((H, W), dtype=np.float32)
+        self.weightedIm = np.empty((H, W), dtype=np.float32)
+        self.filteredIm = np.empty((H, W), dtype=np.float32)
+
+        # interior of the filter response, same as convolve2d(mode='valid')
+        pH, pW = self.filterH // 2, self.filterW // 2
+        self.convIm = self.filteredIm[pH:H-pH, pW:W-pW]
+
+    # score of a bgr splash crop. updates the running mean
+    def update(self, splashBGR):
+        if splashBGR.shape[:2] != self.shape:
+            self.allocate(splashBGR.shape[:2])
+
+        cv2.cvtColor(splashBGR, cv2.COLOR_BGR2GRAY, dst=self.grayIm)
+        np.divide(self.grayIm, 255, out=self.splashIm, dtype=np.float32)
+
+        return self.scoreSplash()
+
+    # score of a [0,1] grayscale splash crop (as logged by Fisher)
+    def updateGray(self, splashGray):
+        if splashGray.shape != self.shape:
+            self.allocate(splashGray.shape)
+
+        self.splashIm[:] = splashGray
+
+        return self.scoreSplash()
+
+    def scoreSplash(self):
+        if self.splashMean is None:
+            # initialize
+            self.splashMean = self.splashIm.copy()
+
+        np.subtract(self.splashIm, self.splashMean, out=self.normIm)
+        np.clip(self.normIm, 0, 1, out=self.normIm)
+
+        # splashMean = a * splashIm + (1 - a) * splashMean
+        np.multiply(self.splashIm, self.alpha, out=self.weightedIm)
+        self.splashMean *= 1 - self.alpha
+        self.splashMean += self.weightedIm
+
+        # convolve to find splotches of white (splash in water)
+        cv2.filter2D(self.normIm, cv2.CV_32F, self.convFilter, dst=self.filteredIm,
+                     borderType=cv2.BORDER_CONSTANT)
+
+        score = cv2.norm(self.convIm, cv2.NORM_L2) / self.convIm.size
+
+        return score
@@ -5,12 +5,61 @@ captureWindowKeyword = 'Red Dead Redemption 2'
 configWindowName = 'RDR2 AI'
 configWindowLocation = (-3400,40)
 
+# headless telemetry (--telemetry): text boxes are sampled SampleFps times a
+# second into a history of History samples, served as json on localhost:Port.
+# images are jpeg encoded at ImageScale of their box only when requested, and
+# modules only build them for ImageHold seconds after a request.
+# MetricsPath also appends every sample to a json lines file ('' = off)
+telemetryPort = 8765
+telemetrySampleFps = 5
+telemetryHistory = 3000 # 10 minutes at 5 samples/s
+telemetryImageScale = 0.5
+telemetryJpegQuality = 70
+telemetryImageHold = 5
+telemetryMetricsPath = ''
+
+# merge capture regions whose joint bounding box is at most this many
+# times their summed area (--roi)
+regionMergeSlack = 1.5
+
 # (x,y) offset from the bottom right that covers all options
 optionsOffsetBR = (450,400)
 
 keyPressLength = 0.2
 mousePressLength = 0.2
 
+# minimap tracking: search a window of +-MinimapTrackWindow px around the
+# last (or velocity predicted) location, full search below MinConfidence or
+# below RelConfidence times the confidence of the last full search
+minimapTracking = True
+minimapTrackWindow = 24
+minimapTrackMinConfidence = 0.35
+minimapTrackRelConfidence = 0.85
+minimapTrackVelocity = True
+
+# pause menu: (rows, cols) probe pixels checked before the full count, None = off.
+# the full count only runs if at least MinRed of the probe pixels are red
+pauseProbeGrid = (4, 4)
+pauseProbeMinRed = 0.5
+
+# record mode: frames go through a queue of RecordQueueSize to a background
+# encoder that writes segments of RecordSegmentFrames frames. a full queue
+# drops the 'newest' (incoming) or 'oldest' (queued) frame
+recordFps = 30 # frame rate stored in the video container
+recordFourcc = 'MJPG'
+recordSegmentFrames = 1800
+recordQueueSize = 6 # full frames, ~15MB each at 3440x1417
+recordDropPolicy = 'newest'
+
+# options change detection: ocr only reruns when at least MinPixels pixels of
+# the downscaled options box moved by more than PixelThresh, or after MaxSkip
+# skipped frames
+optionsChangeDetection = True
+optionsChangeSignatureScale = 0.25
+optionsChangePixelThresh = 40
+optionsChangeMinPixels = 10
+optionsChangeMaxSkip = 30
+
 # template matching and ocr params
 craftingScoreThreshold = 10 ** -2
 textColorTolerance = 25
@@ -20,10 +69,36 @@ minOptionTextGap = 50
 minHorLineHeight = 5
 horLineCoverageThresh = 0.4 # [0,1]
 OCRConfig = r'-l eng --psm 7 --oem 1'
+tessdataPath = 'C:\\Project\\tessdata\\'
+OCRPoolSize = 4 # tesseract instances, option strips are ocr'd in parallel
 minOCRConfidence = 30
+
+# ocr results cached per option strip. hash is 'exact' (strip bytes) or
+# 'perceptual' (downsampled thumbnail, tolerates small jitter)
+OCRCacheSize = 256
+OCRCacheHash = 'exact'
 saveDebugIms = False
 
 spellcheckDistance = 2
 
+# every prompt the action modules look for, as cleaned ocr output (lowercase
+# letters and spaces only, 'Craft/Cook' reads as 'craftcook')
+knownPrompts = ('bait', 'grip reel', 'reel in', 'reel lure', 'reset cast', 'hook fish',
+                'cut line', 'control', 'keep', 'throw back',
+                'cook', 'cook another', 'eat', 'stow', 'back', 'craftcook',
+                'recipe', 'all', 'show all', 'ingredients', 'effects', 'brew', 'leave',
+                'show craftable', 'craftable',
+                'chop', 'pick up', 'put down')
+
+# option strip recognizer per mode, 'tesseract' or 'template'
+optionsRecognizer = {'fish': 'tesseract', 'cook': 'tesseract', 'chores': 'tesseract'}
+promptTemplatesPath = './data/prompt_templates.npz'
+promptTemplateMinScore = 0.8 # [-1,1] ncc, below this falls back to tesseract
+
+# fish calm decision, 'rule' (score derivative sign change) or 'model'
+# (classifier trained with python -m rdr2_ai.data.calmTrainer)
+fishCalmDecision = 'rule'
+calmModelPath = './data/calm_model.npz'
+
 # replace index 0 with index 1
 freqMistakes = [('u','o'),('r','f'),('r','t'),('i','/'),('x','k'),('l','k'),('n','h')]
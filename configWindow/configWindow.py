@@ -1,18 +1,25 @@
-from time import time, sleep
-from multiprocessing import Process, Queue, Lock
+from time import time, perf_counter
+from multiprocessing import Process, Queue
+from multiprocessing.shared_memory import SharedMemory
+from queue import Empty, Full
 
 import numpy as np
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_agg import FigureCanvas
 import cv2
 
 from rdr2_ai.module import Module
 from rdr2_ai.configWindow.configWindowTemplate import ContentBoxInfo,ContentType
+from rdr2_ai.utils.fps import LatencyCounter
 
 class ConfigWindow(Module):
 
+    # producer side of the config window, lives in the main process. images
+    # are copied into a shared memory slot of their content box, only a
+    # (name, buffer, sequence) message goes through the queue. texts and plots
+    # are small and sent as is. the window itself only exists in the draw
+    # process (drawLoop), which keeps the latest event per box
+
+    QUEUE_SIZE = 256
+
     def __init__(self, winName,
                        winLoc,
                        drawFps=15,
@@ -24,139 +31,360 @@ class ConfigWindow(Module):
         self.winLoc = winLoc
         self.font = font
         self.bgColor = bgColor
+        self.winSize = winSize
+        self.template = None
 
-        # create window
-        cv2.namedWindow(self.winName,
-                        cv2.WINDOW_AUTOSIZE    | \
-                        cv2.WINDOW_KEEPRATIO   | \
-                        cv2.WINDOW_GUI_EXPANDED)
-        cv2.moveWindow(self.winName,*self.winLoc)
+        # multiprocessing, the queue is bounded so a stalled draw process can
+        # not make it grow, events that do not fit are dropped
+        self.drawFps = drawFps
+        self.drawQueue = Queue(maxsize=ConfigWindow.QUEUE_SIZE)
+        self.numDropped = 0
+        self.drawProcess = None
+        self.slots = {}
 
         if template is not None:
             self.useTemplate(template)
 
-        elif winSize is not None:
-            self.winSize = winSize
-            canvasShape = (winSize[0],winSize[1],3)
-            self.canvas = np.zeros(canvasShape,dtype=np.float32)
-            self.flush()
-        
-        # multiprocessing
-        self.drawFps = drawFps
-        self.drawQueue = Queue()
-        self.drawProcess = Process(target=self.drawLoop, daemon=True)
+        self.drawCosts = {contentType: LatencyCounter(f'addDrawEvent {contentType.name}')
+                          for contentType in ContentType}
 
     def useTemplate(self, template):
+        if self.drawProcess is not None:
+            self.print('template can not change while the event loop runs.')
+            return
+
         self.template = template
+        self.bgColor = template.bgColor
 
-        canvasShape = (template.size[0],template.size[1],3)
-        self.canvas = np.zeros(canvasShape,dtype=np.float32)
+    # whether the current template shows name
+    def hasContentBox(self, name):
+        return self.template is not None and self.template.getContentBox(name) is not None
+
+    # whether an image for name would be shown, modules skip building it if not
+    def wantsImage(self, name):
+        return name in self.slots
+
+    # (height, width) of a content box, None if the template has none
+    def getContentBoxSize(self, name):
+        if not self.hasContentBox(name):
+            return None
+        return tuple(self.template.getContentBox(name).size)
 
-        self.staticTexts = template.getStaticTexts()
-        self.bgColor = template.bgColor
-        self.flush()
-    
-    def flush(self):
-        self.canvas = self.canvas * 0
-        for c in range(3):
-            self.canvas[:,:,c] = self.bgColor[2-c] # 2-c because opencv uses BGR
-        
-        for st in self.staticTexts:
-            self.drawText(st.text,st.location,st.size)
-    
     def startLoop(self):
         self.print('starting event loop.')
+
+        slotSpecs = []
+        if self.template is not None:
+            for name, cbInfo in self.template.contentBoxes.items():
+                if cbInfo.contentType is ContentType.Image:
+                    slot = ImageSlot(cbInfo.size, create=True)
+                    self.slots[name] = slot
+                    slotSpecs.append((name, tuple(cbInfo.size), slot.shm.name))
+
+        self.drawProcess = Process(target=drawLoop,
+                                   args=(self.winName, self.winLoc, self.drawFps, self.template,
+                                         self.winSize, self.bgColor, self.font, slotSpecs, self.drawQueue),
+                                   daemon=True)
         self.drawProcess.start()
-    
+
     def endLoop(self):
         self.print('ending event loop.')
-        self.drawProcess.terminate()
-
-    def drawLoop(self):
-        run = True
-        lastRenderTime = time()
-        while run:
-            name, data = self.drawQueue.get()
-            self.drawToTemplate(name, data)
+        if self.drawProcess is None:
+            return
 
-            deltaTime = time() - lastRenderTime
-            if deltaTime > 1/self.drawFps:
-                lastRenderTime = time()
-                self.render()
+        try:
+            self.drawQueue.put(None, timeout=1)
+        except Full:
+            pass
+        self.drawProcess.join(timeout=2)
+        if self.drawProcess.is_alive():
+            self.drawProcess.terminate()
+        self.drawProcess = None
+        # events nobody will read must not block the exit
+        self.drawQueue.cancel_join_thread()
+
+        for slot in self.slots.values():
+            slot.close(unlink=True)
+        self.slots = {}
 
     def addDrawEvent(self, name, data):
-        self.drawQueue.put((name, data))
+        if self.drawProcess is None:
+            return
+
+        startTime = perf_counter()
+
+        slot = self.slots.get(name)
+        if slot is not None:
+            event = (name, slot.write(data), None)
+            contentType = ContentType.Image
+        else:
+            event = (name, None, data)
+            cbInfo = self.template.getContentBox(name) if self.template is not None else None
+            contentType = cbInfo.contentType if cbInfo is not None else None
+
+        try:
+            self.drawQueue.put_nowait(event)
+        except Full:
+            self.numDropped += 1
+
+        if contentType is not None:
+            self.drawCosts[contentType].add(perf_counter() - startTime)
+
+    def cleanup(self):
+        self.endLoop()
+        for drawCost in self.drawCosts.values():
+            if drawCost.count:
+                self.print(drawCost.summary())
+        if self.numDropped:
+            self.print(f'{self.numDropped} draw events dropped.')
+
+
+# uint8 version of im with at most 3 channels. bools become 0/255, floats in
+# [0,1] are scaled to [0,255], anything else is saturated as is
+def toUint8(im):
+    if im.dtype == bool:
+        im = im.view(np.uint8) * 255
+    elif im.dtype != np.uint8:
+        alpha = 255 if im.dtype.kind == 'f' and np.amax(im) <= 1 else 1
+        im = cv2.convertScaleAbs(im, alpha=alpha)
+    if im.ndim == 3 and im.shape[2] > 3:
+        im = im[:,:,:3]
+    return im
+
+
+class ImageSlot:
+
+    # double buffered uint8 image of one content box in shared memory, at most
+    # the size of the box (larger images are shrunk, smaller ones are resized
+    # by the draw process). each buffer has a header of (sequence, h, w). the
+    # sequence number is odd while the producer writes the buffer, so the
+    # consumer can drop a copy that was overwritten while it was reading
+
+    HEADER = 4 # int64s per buffer
+
+    def __init__(self, size, create=False, shmName=None):
+        h, w = size
+        headerBytes = 2 * ImageSlot.HEADER * 8
+        self.shm = SharedMemory(name=shmName, create=create, size=headerBytes + 2 * h * w * 3)
+        self.headers = np.ndarray((2, ImageSlot.HEADER), dtype=np.int64, buffer=self.shm.buf)
+        self.buffers = np.ndarray((2, h, w, 3), dtype=np.uint8, buffer=self.shm.buf, offset=headerBytes)
+        if create:
+            self.headers[:] = 0
+        self.nextBuffer = 0
+
+    # copies im into the next buffer, returns (buffer, sequence)
+    def write(self, im):
+        b = self.nextBuffer
+        self.nextBuffer = 1 - b
+        header = self.headers[b]
+        H, W = self.buffers.shape[1:3]
+
+        im = toUint8(im)
+        h, w = im.shape[:2]
+        if h > H or w > W:
+            scale = min(H / h, W / w)
+            h, w = max(1, int(h * scale)), max(1, int(w * scale))
+            im = cv2.resize(im, (w, h), interpolation=cv2.INTER_AREA)
+
+        header[0] += 1 # odd: being written
+        dst = self.buffers[b, :h, :w]
+        if im.ndim == 2:
+            cv2.cvtColor(im, cv2.COLOR_GRAY2BGR, dst=dst)
+        else:
+            dst[:] = im
+        header[1:3] = h, w
+        header[0] += 1
+
+        return b, int(header[0])
+
+    # copy of buffer b, None if it was overwritten since sequence seq
+    def read(self, b, seq):
+        header = self.headers[b]
+        if header[0] != seq:
+            return None
+        h, w = int(header[1]), int(header[2])
+        im = self.buffers[b, :h, :w].copy()
+        if header[0] != seq:
+            return None
+        return im
+
+    def close(self, unlink=False):
+        self.headers = None
+        self.buffers = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def drawLoop(winName, winLoc, drawFps, template, winSize, bgColor, font, slotSpecs, drawQueue):
+    # runs in the draw process. drains the queue, keeps the latest event per
+    # box and renders at most drawFps times per second
+    renderer = ConfigWindowRenderer(winName, winLoc, template, winSize, bgColor, font)
+    slots = {name: ImageSlot(size, shmName=shmName) for name, size, shmName in slotSpecs}
+
+    renderPeriod = 1 / drawFps
+    lastRenderTime = time()
+    run = True
+    while run:
+        latestEvents = {}
+        try:
+            event = drawQueue.get(timeout=renderPeriod)
+            while True:
+                if event is None:
+                    run = False
+                    break
+                latestEvents[event[0]] = event
+                event = drawQueue.get_nowait()
+        except Empty:
+            pass
+
+        startTime = perf_counter()
+        for name, slotRef, data in latestEvents.values():
+            if slotRef is not None:
+                renderer.drawSlot(name, slots[name], *slotRef)
+            else:
+                renderer.drawToTemplate(name, data)
+        if latestEvents:
+            renderer.composeCost.add(perf_counter() - startTime)
+
+        if time() - lastRenderTime > renderPeriod:
+            lastRenderTime = time()
+            renderer.render()
+
+    renderer.cleanup()
+    for slot in slots.values():
+        slot.close()
+
+
+class ConfigWindowRenderer(Module):
+
+    # the window and its uint8 canvas, only used in the draw process. every
+    # content box draws into its own view of the canvas and marks it dirty,
+    # the window is only updated when something is dirty
+
+    def __init__(self, winName, winLoc, template, winSize, bgColor, font):
+        self.winName = winName
+        self.template = template
+        self.bgColor = bgColor
+        self.font = font
+        self.staticTexts = []
+        self.plotBoxes = {}
+        self.regions = {} # name -> canvas view of the content box
+        self.lastTexts = {} # name -> (text, color) on the canvas
+        self.dirtyRects = {} # name -> (y, x, h, w) changed since the last render
+
+        self.composeCost = LatencyCounter('compose')
+        self.presentCost = LatencyCounter('present')
+        self.numRenders = 0
+        self.dirtyArea = 0
+
+        # create window
+        cv2.namedWindow(self.winName,
+                        cv2.WINDOW_AUTOSIZE    | \
+                        cv2.WINDOW_KEEPRATIO   | \
+                        cv2.WINDOW_GUI_EXPANDED)
+        cv2.moveWindow(self.winName,*winLoc)
+
+        if template is not None:
+            canvasShape = (template.size[0],template.size[1],3)
+            self.staticTexts = template.getStaticTexts()
+        else:
+            canvasShape = (winSize[0],winSize[1],3) if winSize is not None else (100,100,3)
+        self.canvas = np.zeros(canvasShape,dtype=np.uint8)
+        self.flush()
+
+    def flush(self):
+        self.canvas[:] = self.bgColor[::-1] # reversed because opencv uses BGR
+
+        for st in self.staticTexts:
+            self.drawText(st.text,st.location,st.size)
+
+        self.lastTexts = {}
+        self.dirtyRects['canvas'] = (0, 0) + self.canvas.shape[:2]
+
+    def getRegion(self, name, cbInfo: ContentBoxInfo):
+        region = self.regions.get(name)
+        if region is None:
+            (y, x), (h, w) = cbInfo.location, cbInfo.size
+            region = self.canvas[y:y+h, x:x+w]
+            self.regions[name] = region
+        return region
+
+    def drawSlot(self, name, slot, b, seq):
+        im = slot.read(b, seq)
+        if im is None:
+            # overwritten while reading, a newer event is already queued
+            return
+        self.drawImage(name, im)
 
     def drawToTemplate(self, name, data):
         if self.template is None:
             self.print('no template used')
             return
-        
+
         cbInfo: ContentBoxInfo = self.template.getContentBox(name)
         if cbInfo is None:
             self.print(f'CONTENT BOX {name} NOT FOUND.')
             return
 
         if cbInfo.contentType is ContentType.Image:
-            self.drawImage(data,cbInfo.location,cbInfo.size)
+            self.drawImage(name, data)
 
         elif cbInfo.contentType is ContentType.Plot:
-            self.drawFig(data, cbInfo.location, cbInfo.size)
+            self.drawPlot(name, data)
 
         elif cbInfo.contentType is ContentType.Text:
             if type(data) is tuple and len(data) == 2:
                 txt, color = data
-                self.drawText(txt, cbInfo.location, cbInfo.size, color=color)
             else:
-                self.drawText(data, cbInfo.location, cbInfo.size)
+                txt, color = data, (255,255,255)
 
-    def drawImage(self, im, loc, size, interp=None):
-        
-        loc = np.array(loc,dtype=np.uint)
-        size = np.array(size,dtype=np.uint)
-
-        # fix type
-        if (im.astype(np.uint8) == im).all() and np.amax(im) > 1:
-            # use as float im
-            im = (im / 255).astype(np.float32)
-
-        # grayscale in 3 channels
-        if len(im.shape) == 2:
-            im = np.stack((im,im,im),axis=2)
-        
-        # fix size
-        cv2Size = (int(size[1]),int(size[0]))
-        if interp is None:
-            interp = cv2.INTER_LINEAR
-        im = cv2.resize(im,cv2Size,interpolation=interp)
-        
-        # add im
-        self.canvas[ loc[0] : (loc+size)[0] , loc[1] : (loc+size)[1]] = im
-    
-    def drawFig(self, data, loc, size):
-
-        fig = plt.figure()
-        for d in data:
-            plt.plot(d)
-
-        loc = np.array(loc,dtype=np.uint)
-        size = np.array(size,dtype=np.uint)
+            # most texts (state, counters) don't change from event to event
+            if self.lastTexts.get(name) == (str(txt), color):
+                return
+            self.lastTexts[name] = (str(txt), color)
+            self.drawText(txt, cbInfo.location, cbInfo.size, color=color)
 
-        sizePLT = (size[1] // 100,size[0] // 100)
+        self.dirtyRects[name] = tuple(cbInfo.location) + tuple(cbInfo.size)
 
-        fig.set_size_inches(*sizePLT)
-        figCanvas = FigureCanvas(fig)
-        figCanvas.draw()
+    def drawImage(self, name, im):
+        cbInfo: ContentBoxInfo = self.template.getContentBox(name)
+        region = self.getRegion(name, cbInfo)
+        h, w = region.shape[:2]
+        # slot images don't go through drawToTemplate
+        self.dirtyRects[name] = tuple(cbInfo.location) + tuple(cbInfo.size)
+
+        im = toUint8(im)
+        if im.shape[:2] != (h, w):
+            shrink = im.shape[0] > h or im.shape[1] > w
+            interp = cv2.INTER_AREA if shrink else cv2.INTER_LINEAR
+            if im.ndim == 3:
+                cv2.resize(im, (w, h), dst=region, interpolation=interp)
+                return
+            # gray is resized first, the colour conversion writes the canvas
+            im = cv2.resize(im, (w, h), interpolation=interp)
+
+        if im.ndim == 2:
+            cv2.cvtColor(im, cv2.COLOR_GRAY2BGR, dst=region)
+        else:
+            region[:] = im
+
+    def drawPlot(self, name, data):
+        cbInfo: ContentBoxInfo = self.template.getContentBox(name)
+        plotBox = self.plotBoxes.get(name)
+        if plotBox is None:
+            plotBox = PlotBox(cbInfo.size)
+            self.plotBoxes[name] = plotBox
 
-        plotIm = cv2.cvtColor(
-            np.array(fig.canvas.get_renderer()._renderer,dtype=np.float32) / 255,
-            cv2.COLOR_RGB2GRAY
-        )
+        h, w = plotBox.size
+        region = self.getRegion(name, cbInfo)
+        region.fill(0)
+        cv2.rectangle(region, (0, 0), (w-1, h-1), (77,77,77), 1)
 
-        plt.close(fig)
+        for i, points in enumerate(plotBox.update(data)):
+            color = PlotBox.COLORS[i % len(PlotBox.COLORS)]
+            cv2.polylines(region, [points], False, color, 2, cv2.LINE_AA)
 
-        self.drawImage(plotIm, loc, size)
-    
     def drawText(self, text, loc, size, color=(255,255,255)):
 
         text = str(text)
@@ -169,21 +397,79 @@ class ConfigWindow(Module):
         (w, h), base = cv2.getTextSize(text, self.font, scale, 2)
         scale = scale * min(size[1]/w , size[0]/h)
 
-        color = tuple(map(lambda p: p/255, color))
-
         # flush old text
-        self.canvas[loc[0] : loc[0] + size[0] + 5, loc[1] : loc[1] + size[1]] = (0.0,0.0,0.0)
-        
+        self.canvas[loc[0] : loc[0] + size[0] + 5, loc[1] : loc[1] + size[1]] = 0
+
         # put new text
         cv2.putText(self.canvas, text, cv2Origin, self.font, scale, color=color, thickness=2, lineType=cv2.FILLED)
-    
+
     def render(self):
-        cv2.imshow(self.winName,self.canvas)
+        if self.dirtyRects:
+            startTime = perf_counter()
+            canvasArea = self.canvas.shape[0] * self.canvas.shape[1]
+            self.dirtyArea += min(canvasArea, sum(h * w for _, _, h, w in self.dirtyRects.values()))
+            self.dirtyRects = {}
+            cv2.imshow(self.winName,self.canvas)
+            self.presentCost.add(perf_counter() - startTime)
+            self.numRenders += 1
+
+        # keep the window responsive even when nothing changed
         key = cv2.waitKey(1)
         if key == 27:
             return False
         return True
 
     def cleanup(self):
-        self.endLoop()
-        cv2.destroyWindow(self.winName)
\ No newline at end of file
+        self.print(self.composeCost.summary())
+        self.print(self.presentCost.summary())
+        if self.numRenders:
+            canvasArea = self.canvas.shape[0] * self.canvas.shape[1]
+            self.print(f'dirty area per render: {self.dirtyArea / self.numRenders / canvasArea:.1%} of the canvas.')
+        cv2.destroyWindow(self.winName)
+
+
+class PlotBox:
+
+    # scaling state of one ContentType.Plot box. data is a list of series, each
+    # drawn as a polyline over the box width (index 0 on the left). the y range
+    # grows as soon as a value falls outside of it and shrinks back slowly, so
+    # the lines don't jump around with every new point
+
+    COLORS = [(180,119,31), (14,127,255), (44,160,44), (40,39,214)] # BGR
+    MARGIN = 8 # px
+    SHRINK = 0.05 # of the unused range per update
+
+    def __init__(self, size):
+        self.size = tuple(int(v) for v in size)
+        self.yMin = None
+        self.yMax = None
+
+    def updateRange(self, lo, hi):
+        if self.yMin is None:
+            self.yMin, self.yMax = lo, hi
+            return
+        self.yMin = lo if lo < self.yMin else self.yMin + PlotBox.SHRINK * (lo - self.yMin)
+        self.yMax = hi if hi > self.yMax else self.yMax + PlotBox.SHRINK * (hi - self.yMax)
+
+    # int32 (x, y) points of every series, relative to the box
+    def update(self, data):
+        series = [np.asarray(d, dtype=np.float32).ravel() for d in data]
+        finite = [d[np.isfinite(d)] for d in series]
+        finite = [d for d in finite if len(d)]
+        if not finite:
+            return []
+        self.updateRange(float(min(d.min() for d in finite)), float(max(d.max() for d in finite)))
+
+        h, w = self.size
+        m = PlotBox.MARGIN
+        yRange = max(self.yMax - self.yMin, 1e-9)
+
+        polylines = []
+        for d in series:
+            if len(d) < 2:
+                continue
+            xs = m + np.arange(len(d)) * ((w - 2*m - 1) / (len(d) - 1))
+            ys = h - 1 - m - (d - self.yMin) * ((h - 2*m - 1) / yRange)
+            keep = np.isfinite(ys)
+            polylines.append(np.stack((xs[keep], ys[keep]), axis=1).round().astype(np.int32))
+        return polylines
@@ -0,0 +1,271 @@
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock, Thread
+from time import perf_counter, time
+from urllib.parse import unquote
+
+import cv2
+import numpy as np
+
+from rdr2_ai import config
+from rdr2_ai.configWindow.configWindow import toUint8
+from rdr2_ai.configWindow.configWindowTemplate import ContentType
+from rdr2_ai.module import Module
+from rdr2_ai.utils.fps import LatencyCounter
+from rdr2_ai.utils.timeSeries import TimeSeries
+
+
+'''
+headless stand-in for ConfigWindow (--telemetry). takes the same draw events
+and templates, but addDrawEvent only stores the latest value of the box
+(images are copied, modules reuse their buffers). a sampler thread reads
+the text boxes at config.telemetrySampleFps and keeps the numeric ones in
+ring buffers, a local http server serves
+
+    /layout             the template, {'size', 'boxes': {name: {type, location, size}}}
+    /metrics            {'time', 'series', 'texts', 'plots', 'images', 'events'}
+    /image/<name>       latest image of a box as jpeg, downscaled on request
+
+series are aligned on their newest sample with time. modules only build
+images (wantsImage) for config.telemetryImageHold seconds after one was
+requested, so the first request after a while gets a stale image or a 404
+'''
+
+
+class TelemetrySink(Module):
+
+    def __init__(self, port: int = None,
+                       host: str = '127.0.0.1',
+                       sampleFps: float = None,
+                       historyLength: int = None,
+                       metricsPath: str = None,
+                       template=None):
+        self.host = host
+        self.port = port if port is not None else config.telemetryPort
+        self.sampleFps = sampleFps if sampleFps is not None else config.telemetrySampleFps
+        self.historyLength = historyLength if historyLength is not None else config.telemetryHistory
+        self.metricsPath = metricsPath if metricsPath is not None else config.telemetryMetricsPath
+        self.template = None
+
+        self.latest = {} # name -> latest event data, written by the main loop only
+        self.numEvents = 0
+        self.imageRequestTimes = {} # name -> time of the last /image request
+
+        # sampled state, guarded by lock (sampler and server threads only)
+        self.lock = Lock()
+        self.times = TimeSeries(self.historyLength, dtype=np.float64)
+        self.series = {} # name -> TimeSeries of a numeric text box
+        self.texts = {} # name -> latest text
+        self.numSamples = 0
+
+        self.stopEvent = Event()
+        self.server = None
+        self.threads = []
+        self.metricsFile = None
+        self.requestCost = LatencyCounter('telemetry request')
+
+        if template is not None:
+            self.useTemplate(template)
+
+    def useTemplate(self, template):
+        self.template = template
+
+    def hasContentBox(self, name):
+        return self.template is not None and self.template.getContentBox(name) is not None
+
+    # (height, width) images of a box are served at
+    def getContentBoxSize(self, name):
+        if not self.hasContentBox(name):
+            return None
+        h, w = self.template.getContentBox(name).size
+        scale = config.telemetryImageScale
+        return max(1, int(h * scale)), max(1, int(w * scale))
+
+    # images are only wanted while someone is looking at them
+    def wantsImage(self, name):
+        if self.template is not None and not self.hasContentBox(name):
+            return False
+        requestTime = self.imageRequestTimes.get(name)
+        return requestTime is not None and time() - requestTime < config.telemetryImageHold
+
+    def addDrawEvent(self, name, data):
+        # the http thread encodes images while the next frame is analysed
+        if isinstance(data, np.ndarray):
+            data = data.copy()
+        self.latest[name] = data
+        self.numEvents += 1
+
+    def startLoop(self):
+        if self.metricsPath:
+            self.metricsFile = open(self.metricsPath, 'a')
+
+        self.server = ThreadingHTTPServer((self.host, self.port), self.makeHandler())
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+
+        self.threads = [Thread(target=self.server.serve_forever, daemon=True),
+                        Thread(target=self.sampleLoop, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+        self.print(f'serving telemetry on http://{self.host}:{self.port}/metrics')
+
+    def sampleLoop(self):
+        samplePeriod = 1 / self.sampleFps
+        nextSampleTime = perf_counter()
+        while not self.stopEvent.wait(max(0, nextSampleTime - perf_counter())):
+            nextSampleTime += samplePeriod
+            self.sample()
+
+    def sample(self):
+        now = time()
+        values = {}
+        for name, data in list(self.latest.items()):
+            if self.boxType(name, data) is not ContentType.Text:
+                continue
+            text = data[0] if type(data) is tuple and len(data) == 2 else data
+            try:
+                values[name] = float(text)
+            except (TypeError, ValueError):
+                values[name] = str(text)
+
+        with self.lock:
+            self.times.append(now)
+            for name, value in values.items():
+                if type(value) is str:
+                    self.texts[name] = value
+                    continue
+                if name not in self.series:
+                    self.series[name] = TimeSeries(self.historyLength)
+                self.series[name].append(value)
+            self.numSamples += 1
+
+        if self.metricsFile is not None:
+            self.metricsFile.write(json.dumps({'time': round(now, 3), **values}, separators=(',', ':')) + '\n')
+            if self.numSamples % max(1, int(self.sampleFps)) == 0:
+                self.metricsFile.flush()
+
+    # content type of a box, guessed from the data without a template
+    def boxType(self, name, data):
+        if self.template is not None:
+            cbInfo = self.template.getContentBox(name)
+            return cbInfo.contentType if cbInfo is not None else None
+        if isinstance(data, np.ndarray):
+            return ContentType.Image
+        if type(data) is list:
+            return ContentType.Plot
+        return ContentType.Text
+
+    @staticmethod
+    def toList(values):
+        return [float(v) if np.isfinite(v) else None for v in values]
+
+    def getLayout(self):
+        if self.template is None:
+            return {'size': None, 'boxes': {}}
+        boxes = {name: {'type': cbInfo.contentType.name,
+                        'location': list(cbInfo.location),
+                        'size': list(cbInfo.size)}
+                 for name, cbInfo in self.template.contentBoxes.items()}
+        return {'size': list(self.template.size), 'boxes': boxes}
+
+    def getMetrics(self):
+        with self.lock:
+            n = len(self.times)
+            metrics = {
+                'time': self.toList(self.times.view()[self.historyLength - n:]),
+                'series': {name: self.toList(ts.view()[self.historyLength - len(ts):])
+                           for name, ts in self.series.items()},
+                'texts': dict(self.texts),
+            }
+
+        plots, images = {}, set()
+        for name, data in list(self.latest.items()):
+            boxType = self.boxType(name, data)
+            if boxType is ContentType.Plot:
+                plots[name] = [self.toList(np.asarray(d, dtype=np.float64).ravel()) for d in data]
+            elif boxType is ContentType.Image:
+                images.add(name)
+        if self.template is not None:
+            # image boxes are only filled once requested
+            images.update(name for name, cbInfo in self.template.contentBoxes.items()
+                          if cbInfo.contentType is ContentType.Image)
+        images = sorted(images)
+
+        metrics.update({'plots': plots, 'images': images, 'events': self.numEvents})
+        return metrics
+
+    # latest image of a box as jpeg bytes, None if there is none
+    def getImageJpeg(self, name):
+        self.imageRequestTimes[name] = time()
+        im = self.latest.get(name)
+        if im is None or self.boxType(name, im) is not ContentType.Image:
+            return None
+
+        im = toUint8(im)
+        if self.template is not None:
+            h, w = self.getContentBoxSize(name)
+            scale = min(1, h / im.shape[0], w / im.shape[1])
+        else:
+            scale = config.telemetryImageScale
+        if scale < 1:
+            size = (max(1, int(im.shape[1] * scale)), max(1, int(im.shape[0] * scale)))
+            im = cv2.resize(im, size, interpolation=cv2.INTER_AREA)
+
+        ok, jpeg = cv2.imencode('.jpg', im, [cv2.IMWRITE_JPEG_QUALITY, config.telemetryJpegQuality])
+        return jpeg.tobytes() if ok else None
+
+    def makeHandler(self):
+        sink = self
+
+        class TelemetryHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                startTime = perf_counter()
+                path = self.path.split('?')[0]
+                if path == '/layout':
+                    self.send(200, 'application/json', json.dumps(sink.getLayout()).encode())
+                elif path in ('/', '/metrics'):
+                    self.send(200, 'application/json', json.dumps(sink.getMetrics()).encode())
+                elif path.startswith('/image/'):
+                    jpeg = sink.getImageJpeg(unquote(path[len('/image/'):]))
+                    if jpeg is None:
+                        self.send(404, 'text/plain', b'no image yet')
+                    else:
+                        self.send(200, 'image/jpeg', jpeg)
+                else:
+                    self.send(404, 'text/plain', b'not found')
+                sink.requestCost.add(perf_counter() - startTime)
+
+            def send(self, status, contentType, body):
+                self.send_response(status)
+                self.send_header('Content-Type', contentType)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Cache-Control', 'no-store')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # requests would flood the frame log
+                pass
+
+        return TelemetryHandler
+
+    def endLoop(self):
+        self.stopEvent.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        if self.metricsFile is not None:
+            self.metricsFile.close()
+            self.metricsFile = None
+
+    def cleanup(self):
+        self.endLoop()
+        self.print(f'{self.numEvents} draw events, {self.numSamples} samples.')
+        if self.requestCost.count:
+            self.print(self.requestCost.summary())
@@ -1,17 +1,23 @@
 from time import time, sleep
 from math import floor
 from enum import IntEnum, auto
+import heapq
 #import asyncio
 from multiprocessing import Process
 from queue import Queue
 
-from pyKey import press, pressKey, releaseKey
-import pydirectinput as pdi
+try:
+    from pyKey import press, pressKey, releaseKey
+    import pydirectinput as pdi
+except ImportError:
+    # windows only, replay runs use a dry run handler
+    pdi = None
 
 from rdr2_ai import config
 from rdr2_ai.configWindow.configWindow import ConfigWindow
 from rdr2_ai.module import Module
 from rdr2_ai.controls.mouse import MouseMoveTo
+from rdr2_ai.utils.fps import LatencyCounter
 
 
 class ActionType(IntEnum):
@@ -22,11 +28,20 @@ class ActionType(IntEnum):
     PAUSE   = auto()
     DONE    = auto()
 
+class EventType(IntEnum):
+    TAP_DOWN    = auto()
+    TAP_UP      = auto()
+    HOLD        = auto()
+    RELEASE     = auto()
+    RELEASE_ALL = auto()
+    MOVE        = auto()
+
 class ActionHandler(Module):
 
     def __init__(self, configWindow: ConfigWindow,
                        showInConfigWindow: bool = False,
-                       printHeld = False):
+                       printHeld = False,
+                       dryRun: bool = False):
         self.keyPressLength = config.keyPressLength
         self.mousePressLength = config.mousePressLength
         
@@ -40,6 +55,9 @@ class ActionHandler(Module):
         self.configWindow = configWindow
         self.showInConfigWindow = showInConfigWindow
 
+        # track state and timing but never send inputs
+        self.dryRun = dryRun
+
     # returns boolean continue
     def doActions(self, actions):
         for action in actions:
@@ -48,6 +66,18 @@ class ActionHandler(Module):
             self.doAction(action)
         return True
 
+    # blocking handler has nothing scheduled between calls
+    def tick(self):
+        pass
+
+    # whether earlier actions are still being carried out, new actions should
+    # not be asked for until this is False
+    def isBusy(self):
+        return False
+
+    def timeToNextEvent(self):
+        return None
+
     def isDoneAction(self, action):
         return action[0] is ActionType.DONE
 
@@ -64,39 +94,21 @@ class ActionHandler(Module):
                 return False
             
             self.pressedKeys[key] = time()
+            if not self.inputDown(key):
+                return False
+
             if key.startswith('MOUSE'):
-                if key == 'MOUSE_LEFT':
-                    pdiButton = pdi.LEFT
-                elif key == 'MOUSE_RIGHT':
-                    pdiButton = pdi.RIGHT
-                else:
-                    self.print(f'unknown mouse button {key} in actionHandler')
-                    return False
-                
-                pdi.mouseDown(button=pdiButton)
                 sleep(self.mousePressLength)
-                pdi.mouseUp(button=pdiButton)
             else:
-                pressKey(key=key)
                 sleep(self.keyPressLength)
-                releaseKey(key=key)
+            self.inputUp(key)
 
         elif actionType == ActionType.HOLD:
             if key in self.heldKeys:
                 self.print(f'attempted to hold key already held [key={key}]')
             else:
-                if key.startswith('MOUSE'):
-                    if key == 'MOUSE_LEFT':
-                        pdiButton = pdi.LEFT
-                    elif key == 'MOUSE_RIGHT':
-                        pdiButton = pdi.RIGHT
-                    else:
-                        self.print(f'unknown mouse button {key} in actionHandler')
-                        return False
-                    
-                    pdi.mouseDown(button=pdiButton)
-                else:
-                    pressKey(key=key)
+                if not self.inputDown(key):
+                    return False
                 
                 self.heldKeys[key] = time()
         
@@ -106,18 +118,8 @@ class ActionHandler(Module):
             elif key not in self.heldKeys:
                 self.print(f'attemped to release key not held [key={key}]')
             else:
-                if key.startswith('MOUSE'):
-                    if key == 'MOUSE_LEFT':
-                        pdiButton = pdi.LEFT
-                    elif key == 'MOUSE_RIGHT':
-                        pdiButton = pdi.RIGHT
-                    else:
-                        self.print(f'unknown mouse button {key} in actionHandler')
-                        return False
-                    
-                    pdi.mouseUp(button=pdiButton)
-                else:
-                    releaseKey(key=key)
+                if not self.inputUp(key):
+                    return False
                 
                 self.heldKeys.pop(key)
 
@@ -125,7 +127,8 @@ class ActionHandler(Module):
             xOff,yOff,dt,iters = self.getMouseMoveParams(key)
             for _ in range(iters):
                 st = time()
-                MouseMoveTo(xOff, yOff, 0)
+                if not self.dryRun:
+                    MouseMoveTo(xOff, yOff, 0)
                 sleep(max(dt - (time()-st),0))
             
         elif actionType == ActionType.PAUSE:
@@ -172,16 +175,214 @@ class ActionHandler(Module):
 
     def releaseAll(self):
         for key in list(self.heldKeys.keys()):
-            if key.startswith('MOUSE'):
-                if key == 'MOUSE_LEFT':
-                    pdiButton = pdi.LEFT
-                elif key == 'MOUSE_RIGHT':
-                    pdiButton = pdi.RIGHT
-                else:
-                    self.print(f'unknown mouse button {key} in actionHandler releaseAll')
-                
-                pdi.mouseUp(button=pdiButton)
+            self.inputUp(key)
+            self.heldKeys.pop(key)
+
+    def getPdiButton(self, key):
+        if key == 'MOUSE_LEFT':
+            return pdi.LEFT
+        elif key == 'MOUSE_RIGHT':
+            return pdi.RIGHT
+        
+        self.print(f'unknown mouse button {key} in actionHandler')
+        return None
+
+    # send a key/button down event, returns success
+    def inputDown(self, key):
+        if self.dryRun:
+            return True
+        if key.startswith('MOUSE'):
+            pdiButton = self.getPdiButton(key)
+            if pdiButton is None:
+                return False
+            pdi.mouseDown(button=pdiButton)
+        else:
+            pressKey(key=key)
+        return True
+
+    # send a key/button up event, returns success
+    def inputUp(self, key):
+        if self.dryRun:
+            return True
+        if key.startswith('MOUSE'):
+            pdiButton = self.getPdiButton(key)
+            if pdiButton is None:
+                return False
+            pdi.mouseUp(button=pdiButton)
+        else:
+            releaseKey(key=key)
+        return True
+
+
+class ScheduledActionHandler(ActionHandler):
+
+    # turns actions into timestamped input events and sends the ones that are
+    # due on each tick, so TAP/PAUSE/MOVE never sleep on the calling thread.
+    # actions of a list run one after another: each is scheduled after the
+    # previous one finishes, same as the blocking handler. a new list replaces
+    # whatever is still pending from older ones (only releases are kept, and
+    # sent right away), so the schedule never falls behind the frames. callers
+    # should check isBusy() before asking modules for new actions. a dry run
+    # sends nothing, so its clock jumps to each event instead of waiting
+
+    def __init__(self, configWindow: ConfigWindow,
+                       showInConfigWindow: bool = False,
+                       printHeld = False,
+                       dryRun: bool = False):
+        super().__init__(configWindow,
+                         showInConfigWindow=showInConfigWindow,
+                         printHeld=printHeld,
+                         dryRun=dryRun)
+        
+        self.events = [] # heap of (targetTime, seq, eventType, key)
+        self.eventSeq = 0
+        self.scheduleEndTime = 0.0
+
+        # keys that are down because of a tap, waiting for their TAP_UP
+        self.tapKeys = {}
+
+        self.eventLateness = LatencyCounter('eventLateness')
+        self.numReplaced = 0
+
+        self.clockOffset = 0.0 # how far a dry run skipped ahead
+
+    # schedule time, real time plus whatever a dry run skipped
+    def now(self):
+        return time() + self.clockOffset
+
+    # returns boolean continue
+    def doActions(self, actions):
+        if actions and (self.events or self.scheduleEndTime > self.now()):
+            self.replacePending()
+        for action in actions:
+            if self.isDoneAction(action):
+                return False
+            self.scheduleAction(action)
+        self.tick()
+        return True
+
+    def scheduleAction(self, action):
+        actionType, key = action
+
+        self.print(f'scheduling action ({actionType},{key})')
+
+        t = max(self.scheduleEndTime, self.now())
+
+        if actionType == ActionType.TAP:
+            pressLength = self.mousePressLength if key.startswith('MOUSE') else self.keyPressLength
+            self.addEvent(t, EventType.TAP_DOWN, key)
+            t += pressLength
+            self.addEvent(t, EventType.TAP_UP, key)
+
+        elif actionType == ActionType.HOLD:
+            self.addEvent(t, EventType.HOLD, key)
+
+        elif actionType == ActionType.RELEASE:
+            if key == 'ALL':
+                self.addEvent(t, EventType.RELEASE_ALL, key)
             else:
-                releaseKey(key=key)
+                self.addEvent(t, EventType.RELEASE, key)
 
-            self.heldKeys.pop(key)
+        elif actionType == ActionType.MOVE:
+            xOff,yOff,dt,iters = self.getMouseMoveParams(key)
+            for _ in range(iters):
+                self.addEvent(t, EventType.MOVE, (xOff, yOff))
+                t += dt
+
+        elif actionType == ActionType.PAUSE:
+            t += key
+
+        self.scheduleEndTime = t
+
+    # drops the pending events of older action lists, releases are kept and
+    # sent right away so nothing stays pressed
+    def replacePending(self):
+        now = self.now()
+        keep = [(now, seq, eventType, key) for _, seq, eventType, key in self.events
+                if eventType in (EventType.TAP_UP, EventType.RELEASE, EventType.RELEASE_ALL)]
+        self.numReplaced += len(self.events) - len(keep)
+        self.events = keep
+        heapq.heapify(self.events)
+        self.scheduleEndTime = now
+
+    def isBusy(self):
+        return bool(self.events) or self.scheduleEndTime > self.now()
+
+    def addEvent(self, targetTime, eventType, key):
+        heapq.heappush(self.events, (targetTime, self.eventSeq, eventType, key))
+        self.eventSeq += 1
+
+    def tick(self):
+        while self.events:
+            if self.events[0][0] > self.now():
+                if not self.dryRun:
+                    break
+                # nothing is sent, jump to the event (--replay runs at frame rate)
+                self.clockOffset += self.events[0][0] - self.now()
+
+            targetTime, _, eventType, key = heapq.heappop(self.events)
+
+            lateness = self.now() - targetTime
+            self.eventLateness.add(lateness)
+
+            self.sendEvent(eventType, key)
+            self.print(f'sent event ({eventType.name},{key}) {1000*lateness:.1f}ms late')
+
+        if self.dryRun:
+            # trailing pauses too
+            self.clockOffset += max(0, self.scheduleEndTime - self.now())
+
+    def timeToNextEvent(self):
+        if not self.events:
+            return None
+        return max(self.events[0][0] - self.now(), 0)
+
+    def sendEvent(self, eventType, key):
+
+        if eventType == EventType.TAP_DOWN:
+            if key in self.heldKeys:
+                self.print(f'attempted to tap key already held [key={key}]')
+                return
+            
+            self.pressedKeys[key] = self.now()
+            if self.inputDown(key):
+                self.tapKeys[key] = self.now()
+
+        elif eventType == EventType.TAP_UP:
+            # tap was skipped or already released by a RELEASE ALL
+            if key in self.tapKeys:
+                self.inputUp(key)
+                self.tapKeys.pop(key)
+
+        elif eventType == EventType.HOLD:
+            if key in self.heldKeys:
+                self.print(f'attempted to hold key already held [key={key}]')
+            elif self.inputDown(key):
+                self.heldKeys[key] = self.now()
+
+        elif eventType == EventType.RELEASE:
+            if key not in self.heldKeys:
+                self.print(f'attemped to release key not held [key={key}]')
+            elif self.inputUp(key):
+                self.heldKeys.pop(key)
+
+        elif eventType == EventType.RELEASE_ALL:
+            self.releaseAll()
+
+        elif eventType == EventType.MOVE:
+            xOff, yOff = key
+            if not self.dryRun:
+                MouseMoveTo(xOff, yOff, 0)
+
+    def cleanup(self):
+        # drop anything not sent yet, nothing may stay pressed
+        self.events = []
+        self.releaseAll()
+        self.print(self.eventLateness.summary())
+        self.print(f'{self.numReplaced} pending events replaced by newer actions.')
+
+    def releaseAll(self):
+        for key in list(self.tapKeys.keys()):
+            self.inputUp(key)
+            self.tapKeys.pop(key)
+        super().releaseAll()
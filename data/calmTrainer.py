@@ -0,0 +1,148 @@
+import argparse
+from time import perf_counter
+
+import numpy as np
+
+from rdr2_ai.analysisModules.calm import CalmClassifier
+from rdr2_ai.analysisModules.splash import SplashScorer
+from rdr2_ai.data.dataset import FishDataset
+from rdr2_ai.module import Module
+from rdr2_ai.utils.timeSeries import TimeSeries
+
+
+'''
+trains the fish calm classifier (analysisModules/calm.py) on the runs logged
+by FishData (Fisher.LOG = True), labels are key_is_calm
+
+python -m rdr2_ai.data.calmTrainer [--dataDir ./data/fishing] [--out ./data/calm_model.npz]
+'''
+
+
+class CalmTrainer(Module):
+
+    def __init__(self, dataDir: str = './data/fishing',
+                       pad: int = 50,
+                       skip: int = 2,
+                       bufferLength: int = 15):
+        self.dataset = FishDataset(dataDir)
+        self.pad = pad # Fisher.LOG_PAD, logged crops are padded by this much
+        self.skip = skip # Fisher.SKIP
+        self.bufferLength = bufferLength
+
+    def loadRun(self, runName):
+        ims = self.dataset.runFrames(runName, 'im')
+        keyIsCalm = self.dataset.runColumn(runName, 'key_is_calm').astype(bool)
+        isCalm = self.dataset.runColumn(runName, 'is_calm').astype(bool)
+        return ims, keyIsCalm, isCalm
+
+    # replays a run through the same SplashScorer and score history as Fisher
+    def runFeatures(self, ims):
+        scorer = SplashScorer(skip=self.skip, bufferLength=self.bufferLength)
+        calmScores = TimeSeries(self.bufferLength, fill=-1, window=2)
+        classifier = CalmClassifier()
+
+        p = self.pad
+        features = []
+        for im in ims:
+            calmScores.append(scorer.updateGray(im[p:im.shape[0]-p, p:im.shape[1]-p]))
+            features.append(classifier.features(scorer.normIm, calmScores))
+        return np.array(features, dtype=np.float32)
+
+    def loadDataset(self):
+        X, y, rule, runIdx = [], [], [], []
+        for i, runName in enumerate(self.dataset.runNames):
+            ims, keyIsCalm, isCalm = self.loadRun(runName)
+            features = self.runFeatures(ims)
+            X.append(features)
+            y.append(keyIsCalm)
+            rule.append(isCalm)
+            runIdx.append(np.full(len(features), i))
+            self.print(f'{runName}: {len(features)} frames.')
+
+        if not X:
+            raise ValueError(f'no runs found in {self.dataset.dataDir}')
+
+        return np.concatenate(X), np.concatenate(y), np.concatenate(rule), np.concatenate(runIdx)
+
+    @staticmethod
+    def split(runIdx, testFraction=0.2):
+        # hold out whole runs when there are enough of them, neighbouring
+        # frames are nearly identical
+        runs = np.unique(runIdx)
+        if len(runs) >= 3:
+            testRuns = runs[::max(2, int(round(1 / testFraction)))]
+            isTest = np.isin(runIdx, testRuns)
+        else:
+            isTest = np.arange(len(runIdx)) >= int(len(runIdx) * (1 - testFraction))
+        return ~isTest, isTest
+
+    @staticmethod
+    def fitLogistic(X, y, l2=1e-2, lr=0.5, epochs=2000):
+        # full batch gradient descent on standardized features
+        featureMean = X.mean(axis=0)
+        featureStd = X.std(axis=0) + 1e-9
+        Z = (X - featureMean) / featureStd
+
+        w = np.zeros(X.shape[1])
+        b = 0.0
+        t = y.astype(np.float64)
+        for _ in range(epochs):
+            p = 1 / (1 + np.exp(-(Z @ w + b)))
+            w -= lr * (Z.T @ (p - t) / len(t) + l2 * w)
+            b -= lr * np.mean(p - t)
+
+        return w, b, featureMean, featureStd
+
+    def train(self, modelPath=None):
+        X, y, rule, runIdx = self.loadDataset()
+        isTrain, isTest = CalmTrainer.split(runIdx)
+
+        w, b, featureMean, featureStd = CalmTrainer.fitLogistic(X[isTrain], y[isTrain])
+
+        classifier = CalmClassifier(modelPath)
+        classifier.weights = w.astype(np.float32)
+        classifier.bias = float(b)
+        classifier.featureMean = featureMean.astype(np.float32)
+        classifier.featureStd = featureStd.astype(np.float32)
+
+        predict = lambda X: np.array([classifier.probability(x) > classifier.threshold for x in X], dtype=bool)
+        accuracy = lambda pred, mask: np.mean(pred[mask] == y[mask]) if mask.any() else float('nan')
+
+        pred = predict(X)
+        self.print(f'frames: {isTrain.sum()} train, {isTest.sum()} test, {y.mean():.1%} calm')
+        self.print(f'model accuracy: train {accuracy(pred, isTrain):.1%}, test {accuracy(pred, isTest):.1%}')
+        self.print(f'rule accuracy (is_calm): train {accuracy(rule, isTrain):.1%}, test {accuracy(rule, isTest):.1%}')
+
+        self.reportLatency(classifier)
+
+        classifier.save()
+        return classifier
+
+    def reportLatency(self, classifier, numFrames=1000):
+        # Fisher's per frame cost: features from the splash image + score history
+        scorer = SplashScorer(skip=self.skip, bufferLength=self.bufferLength)
+        calmScores = TimeSeries(self.bufferLength, fill=-1, window=2)
+        ims, _, _ = self.loadRun(self.dataset.runNames[-1])
+
+        times = []
+        p = self.pad
+        for _, im in zip(range(numFrames), ims):
+            calmScores.append(scorer.updateGray(im[p:im.shape[0]-p, p:im.shape[1]-p]))
+            startTime = perf_counter()
+            classifier.isCalm(scorer.normIm, calmScores)
+            times.append(perf_counter() - startTime)
+
+        times = 1e6 * np.array(times)
+        self.print(f'inference latency: mean {times.mean():.1f}us, max {times.max():.1f}us over {len(times)} frames')
+
+
+if __name__ == '__main__':
+
+    argParser = argparse.ArgumentParser(description='Train the fish calm classifier on logged fishing runs.')
+    argParser.add_argument('--dataDir', '-d', default='./data/fishing', type=str,
+                           help='Directory with the FishData runs.')
+    argParser.add_argument('--out', '-o', default=None, type=str,
+                           help='Model file to write (default config.calmModelPath).')
+    args = argParser.parse_args()
+
+    CalmTrainer(args.dataDir).train(args.out)
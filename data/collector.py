@@ -1,21 +1,32 @@
+import json
 import os
+from queue import Queue
+from threading import Semaphore, Thread
 
 import numpy as np
-import pandas as pd
-import cv2
 
 from rdr2_ai.module import Module
 
 class FishData(Module):
 
+    # streams logged frames to disk from a background thread. a frame is
+    # complete once every label has been logged for it, complete frames go
+    # to the writer thread, at most QUEUE_SIZE at a time (more = frame
+    # dropped, the main loop never waits on disk). every label is stored as
+    # a stack of fixed size chunks run_N/<label>_<K>.npy (np.load(...,
+    # mmap_mode='r')), run_N/index.json lists them once the run is written
+
+    CHUNK_SIZE = 256
+    QUEUE_SIZE = 512
+
     def __init__(self, labels: list[str]):
         self.writeDir = os.path.join('./data/fishing')
         if not os.path.exists(self.writeDir):
             os.makedirs(self.writeDir)
 
-        # pick up where we left off
+        # pick up where we left off (run_N.csv legacy runs, run_N chunked runs)
         currFiles = os.listdir(self.writeDir)
-        isRelevant = lambda f: f.endswith('.csv') and f.startswith('run_')
+        isRelevant = lambda f: f.startswith('run_') and (f.endswith('.csv') or f[len('run_'):].isnumeric())
         relFiles = filter(isRelevant, currFiles)
         getNumeric = lambda s: int(''.join([c for c in s if c.isnumeric()]))
         currIds = map(getNumeric, relFiles)
@@ -24,74 +35,127 @@ class FishData(Module):
 
         self.labels = labels
         self.createNewRunDict()
+        self.numDropped = 0
+
+        # run ends are never dropped, only frames count against the bound
+        self.queue = Queue()
+        self.frameSlots = Semaphore(FishData.QUEUE_SIZE)
+        self.writer = Thread(target=self.writerLoop, daemon=True)
+        self.writer.start()
 
         self.print(f'starting with index {self.currRunId}')
-        
+
     def log(self, label, data):
         if label not in self.runData:
             self.print(f'label {label} not found.')
             return
-        
+
         runList = self.runData[label]
         runList.append(data)
-    
-    def write(self):
-        self.print('writing to log file.')
 
-        isValid = self.validateRuns()
-        if not isValid:
+        if all(self.runData.values()):
+            frame = {label: self.runData[label].pop(0) for label in self.labels}
+            if self.frameSlots.acquire(blocking=False):
+                self.queue.put(('frame', self.currRunId, frame))
+                self.runNumFrames += 1
+            else:
+                self.numDropped += 1
+
+    def write(self):
+        if self.runNumFrames == 0:
+            # nothing logged since the last write
             return
-        
-        self.writeImages()
-        self.writeData()
+
+        runLens = {label: len(self.runData[label]) for label in self.labels}
+        if any(runLens.values()):
+            self.print(f'discarding incomplete frame {runLens}.')
+
+        # the writer closes the run, the next frames start a new one
+        self.queue.put(('end', self.currRunId, None))
+        self.print(f'run {self.currRunId} done ({self.runNumFrames} frames).')
 
         self.createNewRunDict()
         self.currRunId += 1
-    
+
     def createNewRunDict(self):
         self.runData = {label: [] for label in self.labels}
+        self.runNumFrames = 0
 
-    def validateRuns(self):
-        runLens = {label: len(self.runData[label]) for label in self.labels}
-        if len(set(runLens.values())) != 1:
-            self.print(f'invalid run lengths {runLens}.')
-            return False
-        if not all(runLens.values()):
-            # we have an empty pt
-            self.print('no data to log.')
-            return False
-        return True
-
-    def writeImages(self):
-        imLabels = self.getImageLabels()
-
-        for label in imLabels:
-            imDir = os.path.join(self.writeDir, f'run_{self.currRunId}_{label}')
-            os.mkdir(imDir)
-            ims = self.runData[label]
-            numberWidth = len(str(len(ims)))
-            for i, im in enumerate(ims):
-                imPath = os.path.join(imDir, str(i).zfill(numberWidth) + '.tiff') # for windows sorting
-                cv2.imwrite(imPath, im)
-            self.print(f'wrote {len(ims)} images with label {label}.')
-    
-    def getImageLabels(self):
-        imLabels = []
-        for label, data in self.runData.items():
-            if data and type(data[0]) is np.ndarray:
-                imLabels.append(label)
-        return imLabels
-    
-    def writeData(self):
-        runDataPath = os.path.join(self.writeDir, f'run_{self.currRunId}.csv')
-        relevantRunData = {label: self.runData[label] for label in self.getDataLabels()}
-        if len(relevantRunData) > 0:
-            df = pd.DataFrame.from_dict(relevantRunData)
-            df.to_csv(runDataPath, index=False)
-            self.print(f'wrote {np.prod(df.shape)} data points.')
-        
-    def getDataLabels(self):
-        return list(set(self.labels) - set(self.getImageLabels()))
+    def writerLoop(self):
+        run = None
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            kind, runId, frame = item
+            if kind == 'frame':
+                if run is None:
+                    run = RunWriter(self.writeDir, runId, FishData.CHUNK_SIZE)
+                run.add(frame)
+                self.frameSlots.release()
+            elif kind == 'end' and run is not None:
+                numFrames = run.close()
+                self.print(f'wrote run {runId} ({numFrames} frames).')
+                run = None
 
     def cleanup(self):
-        pass
+        self.write()
+        self.queue.put(None)
+        self.writer.join()
+        if self.numDropped:
+            self.print(f'dropped {self.numDropped} frames, writer could not keep up.')
+
+
+class RunWriter:
+
+    # chunked per label .npy files of one run, only used by the writer thread
+
+    def __init__(self, writeDir, runId, chunkSize):
+        self.runDir = os.path.join(writeDir, f'run_{runId}')
+        os.makedirs(self.runDir, exist_ok=True)
+        self.chunkSize = chunkSize
+
+        self.numFrames = 0
+        self.chunks = {} # label -> preallocated chunk
+        self.chunkLens = {} # label -> frames in chunk
+        self.chunkFiles = {} # label -> [(file, numFrames)]
+
+    def add(self, frame):
+        for label, data in frame.items():
+            data = np.asarray(data)
+            chunk = self.chunks.get(label)
+            if chunk is not None and (chunk.shape[1:] != data.shape or chunk.dtype != data.dtype):
+                # shape changed mid chunk, start a new one
+                self.flush(label)
+                chunk = None
+            if chunk is None:
+                chunk = np.empty((self.chunkSize,) + data.shape, dtype=data.dtype)
+                self.chunks[label] = chunk
+                self.chunkLens[label] = 0
+
+            chunk[self.chunkLens[label]] = data
+            self.chunkLens[label] += 1
+            if self.chunkLens[label] == self.chunkSize:
+                self.flush(label)
+
+        self.numFrames += 1
+
+    def flush(self, label):
+        n = self.chunkLens.get(label, 0)
+        if n:
+            files = self.chunkFiles.setdefault(label, [])
+            chunkFile = f'{label}_{len(files)}.npy'
+            np.save(os.path.join(self.runDir, chunkFile), self.chunks[label][:n])
+            files.append((chunkFile, n))
+        self.chunks.pop(label, None)
+        self.chunkLens[label] = 0
+
+    def close(self):
+        for label in list(self.chunks.keys()):
+            self.flush(label)
+
+        with open(os.path.join(self.runDir, 'index.json'), 'w') as f:
+            json.dump({'numFrames': self.numFrames, 'chunks': self.chunkFiles}, f, indent=1)
+
+        return self.numFrames
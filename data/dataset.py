@@ -0,0 +1,179 @@
+import json
+import os
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from rdr2_ai.data.collector import FishData, RunWriter
+from rdr2_ai.module import Module
+
+
+class FishDataset(Module):
+
+    # every run in dataDir as memory mapped arrays. chunked runs (run_N/, see
+    # FishData) are mapped in place, legacy runs (run_N.csv + run_N_<label>/
+    # tiffs) are converted to the chunked format in cacheDir once. index()
+    # only touches runs that are new or changed since the last call
+
+    def __init__(self, dataDir: str = './data/fishing',
+                       cacheDir: str = None):
+        self.dataDir = dataDir
+        self.cacheDir = cacheDir if cacheDir is not None else os.path.join(dataDir, '.cache')
+        self.manifestPath = os.path.join(self.cacheDir, 'manifest.json')
+
+        self.manifest = {} # run name -> {'dir', 'signature'}
+        if os.path.exists(self.manifestPath):
+            with open(self.manifestPath) as f:
+                self.manifest = json.load(f)
+
+        self.runs = [] # (run name, numFrames, {label: (chunks, chunk offsets)})
+        self.runStarts = np.zeros(1, dtype=np.int64)
+        self.index()
+
+    def __len__(self):
+        return int(self.runStarts[-1])
+
+    # label -> value of frame i
+    def __getitem__(self, i):
+        r, j = self.locate(i)
+        _, _, columns = self.runs[r]
+        return {label: FishDataset.read(chunks, offsets, j) for label, (chunks, offsets) in columns.items()}
+
+    @property
+    def labels(self):
+        if not self.runs:
+            return []
+        return list(self.runs[0][2].keys())
+
+    @property
+    def runNames(self):
+        return [name for name, _, _ in self.runs]
+
+    def index(self):
+        # picks up new and changed runs, returns how many were (re)indexed
+        numIndexed = 0
+        runs = []
+        for name, kind in self.scanRuns():
+            signature = self.getSignature(name, kind)
+            entry = self.manifest.get(name)
+            if entry is None or entry['signature'] != signature:
+                entry = {'dir': self.prepareRun(name, kind), 'signature': signature}
+                self.manifest[name] = entry
+                numIndexed += 1
+            runs.append(self.mapRun(name, entry['dir']))
+
+        if numIndexed:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            with open(self.manifestPath, 'w') as f:
+                json.dump(self.manifest, f, indent=1)
+
+        self.runs = [run for run in runs if run[1] > 0]
+        self.runStarts = np.cumsum([0] + [numFrames for _, numFrames, _ in self.runs])
+
+        self.print(f'{len(self.runs)} runs, {len(self)} frames ({numIndexed} newly indexed).')
+        return numIndexed
+
+    def scanRuns(self):
+        runs = []
+        for f in os.listdir(self.dataDir):
+            if not f.startswith('run_'):
+                continue
+            num = f[len('run_'):]
+            if num.isnumeric() and os.path.exists(os.path.join(self.dataDir, f, 'index.json')):
+                runs.append((int(num), f, 'chunked'))
+            elif f.endswith('.csv') and num[:-len('.csv')].isnumeric():
+                runs.append((int(num[:-len('.csv')]), f[:-len('.csv')], 'legacy'))
+        return [(name, kind) for _, name, kind in sorted(runs)]
+
+    def getSignature(self, name, kind):
+        if kind == 'chunked':
+            path = os.path.join(self.dataDir, name, 'index.json')
+        else:
+            path = os.path.join(self.dataDir, name + '.csv')
+        return os.path.getmtime(path)
+
+    def prepareRun(self, name, kind):
+        if kind == 'chunked':
+            return os.path.join(self.dataDir, name)
+
+        # legacy: csv columns + one tiff folder per image label
+        df = pd.read_csv(os.path.join(self.dataDir, name + '.csv'))
+        imDirs = {f[len(name)+1:]: os.path.join(self.dataDir, f) for f in os.listdir(self.dataDir)
+                  if f.startswith(name + '_') and os.path.isdir(os.path.join(self.dataDir, f))}
+        imFiles = {label: sorted(os.listdir(d)) for label, d in imDirs.items()}
+
+        numFrames = min([len(df)] + [len(files) for files in imFiles.values()])
+        if any(len(files) != len(df) for files in imFiles.values()):
+            self.print(f'{name}: {len(df)} rows but {[len(f) for f in imFiles.values()]} images, keeping {numFrames}.')
+
+        writer = RunWriter(self.cacheDir, name[len('run_'):], FishData.CHUNK_SIZE)
+        columns = {label: df[label].to_numpy() for label in df.columns}
+        for i in range(numFrames):
+            frame = {label: values[i] for label, values in columns.items()}
+            for label, files in imFiles.items():
+                frame[label] = cv2.imread(os.path.join(imDirs[label], files[i]), cv2.IMREAD_UNCHANGED)
+            writer.add(frame)
+        writer.close()
+
+        self.print(f'converted legacy {name} ({numFrames} frames).')
+        return writer.runDir
+
+    def mapRun(self, name, runDir):
+        with open(os.path.join(runDir, 'index.json')) as f:
+            runIndex = json.load(f)
+
+        columns = {}
+        for label, chunkFiles in runIndex['chunks'].items():
+            chunks = [np.load(os.path.join(runDir, chunkFile), mmap_mode='r') for chunkFile, _ in chunkFiles]
+            offsets = np.cumsum([0] + [n for _, n in chunkFiles])
+            columns[label] = (chunks, offsets)
+
+        return name, runIndex['numFrames'], columns
+
+    @staticmethod
+    def read(chunks, offsets, j):
+        c = int(np.searchsorted(offsets, j, side='right')) - 1
+        return chunks[c][j - offsets[c]]
+
+    # (run, frame in run) of frame i
+    def locate(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f'frame {i} out of range ({len(self)} frames)')
+        r = int(np.searchsorted(self.runStarts, i, side='right')) - 1
+        return r, int(i - self.runStarts[r])
+
+    # stacked values of label for the given frames
+    def get(self, indices, label):
+        values = []
+        for i in indices:
+            r, j = self.locate(int(i))
+            chunks, offsets = self.runs[r][2][label]
+            values.append(FishDataset.read(chunks, offsets, j))
+        return np.stack(values)
+
+    # all values of label in one run, in order (one copy per chunk)
+    def runColumn(self, runName, label):
+        _, _, columns = self.runs[self.runNames.index(runName)]
+        chunks, _ = columns[label]
+        return np.concatenate(chunks)
+
+    # values of label in one run, frame by frame, without loading the run
+    def runFrames(self, runName, label):
+        _, _, columns = self.runs[self.runNames.index(runName)]
+        chunks, _ = columns[label]
+        for chunk in chunks:
+            yield from chunk
+
+    # dicts label -> stacked values of batchSize frames
+    def batches(self, batchSize: int, labels=None, shuffle: bool = False, seed: int = None):
+        labels = labels if labels is not None else self.labels
+        order = np.arange(len(self))
+        if shuffle:
+            np.random.default_rng(seed).shuffle(order)
+
+        for start in range(0, len(order), batchSize):
+            indices = order[start:start + batchSize]
+            yield {label: self.get(indices, label) for label in labels}
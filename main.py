@@ -1,22 +1,27 @@
 from enum import Enum
-from time import sleep, time
+from time import sleep, time, perf_counter
 from dataclasses import dataclass
+from threading import Event, Thread
+from queue import Empty
 import argparse
 import sys
 
 from timerUtility.profiler import Profiler
 
 from rdr2_ai import config
-from rdr2_ai.controls.actionHandler import ActionHandler
+from rdr2_ai.controls.actionHandler import ActionHandler, ActionType, ScheduledActionHandler
 from rdr2_ai.module import Module
 from rdr2_ai.configWindow.configWindow import ConfigWindow
+from rdr2_ai.configWindow.telemetry import TelemetrySink
 from rdr2_ai.actionModules.cooker import Cooker,cookerConfigWindowTemplate
 from rdr2_ai.actionModules.fisher import Fisher,fisherConfigWindowTemplate
 from rdr2_ai.actionModules.chorer import Chorer,chorerConfigWindowTemplate
 from rdr2_ai.analysisModules.pause import PauseMenu
 from rdr2_ai.actionModules.recorder import Recorder
-from rdr2_ai.utils.capture import Capture
-from rdr2_ai.utils.fps import FPSCounter
+from rdr2_ai.utils.replay import ReplayCapture
+from rdr2_ai.utils.fps import FPSCounter, LatencyCounter
+from rdr2_ai.utils.pipeline import LatestActionsQueue, LatestQueue, Stamped
+from rdr2_ai.utils.utils import mergeRegions
 from rdr2_ai.heartbeatModules.food import Food
 
 class AIMode(Enum):
@@ -29,9 +34,15 @@ class AIMode(Enum):
 class AIArguments:
     mode: str
     showConfigWindow: bool
+    telemetry: bool
     initTime: int
     recordDir: str
     doProfile: bool
+    pipeline: bool
+    scheduleActions: bool
+    replay: str
+    replayFps: float
+    roi: bool
 
 class Main(Module):
 
@@ -39,12 +50,17 @@ class Main(Module):
         
         # get config settings
         self.initTime = args.initTime
+        self.usePipeline = args.pipeline
+        self.useROI = args.roi
         captureWindowKeyword = config.captureWindowKeyword
         outputWindowName = config.configWindowName
         outputWindowLocation = config.configWindowLocation
 
         # init modules
-        if args.showConfigWindow:
+        if args.telemetry:
+            # same draw events and templates, served over http instead of a window
+            self.configWindow = TelemetrySink()
+        elif args.showConfigWindow:
             self.configWindow = ConfigWindow(outputWindowName,outputWindowLocation)
         else:
             self.configWindow = None
@@ -55,8 +71,22 @@ class Main(Module):
         else:
             self.profiler = None
 
-        self.capture = Capture(captureWindowKeyword, updateWindow=False)
-        self.actionHandler = ActionHandler(configWindow=self.configWindow, printHeld=True)
+        self.captureWindowKeyword = captureWindowKeyword
+        self.replay = args.replay
+        self.replayFps = args.replayFps
+        if args.replay:
+            # headless run on recorded frames, inputs are only logged
+            self.initTime = 0
+
+        # mss keeps its device contexts per thread, so in --pipeline mode the
+        # capture is created on the capture thread (captureStage)
+        self.capture = None if self.usePipeline else self.createCapture()
+
+        if args.replay or args.scheduleActions:
+            self.actionHandler = ScheduledActionHandler(configWindow=self.configWindow, printHeld=True,
+                                                        dryRun=bool(args.replay))
+        else:
+            self.actionHandler = ActionHandler(configWindow=self.configWindow, printHeld=True)
         self.fpsCounter = FPSCounter(configWindow=self.configWindow)
         self.pauseMenu = PauseMenu()
 
@@ -78,6 +108,10 @@ class Main(Module):
             self.actionModule = Recorder(args.recordDir)
 
     def runMainLoop(self):
+
+        if self.usePipeline:
+            self.runPipelinedLoop()
+            return
         
         self.initCountdown()
 
@@ -88,10 +122,21 @@ class Main(Module):
             self.configWindow.startLoop()
 
         while run:
+            # earlier actions (pauses, mouse moves) are still playing out, a
+            # frame taken now would only queue actions behind them
+            if self.actionHandler.isBusy():
+                timeout = self.actionHandler.timeToNextEvent()
+                sleep(0.01 if timeout is None else min(timeout, 0.01))
+                self.actionHandler.tick()
+                continue
+
             self.print(f'frame {frameNum}')
 
             # capture window
-            frame = self.capture.captureWindow()
+            frame = self.capture.captureWindow(self.getRequiredRegions())
+            if frame is None:
+                self.print('no more frames.')
+                break
 
             # break if in pause menu
             gameIsPaused = self.pauseMenu.gameIsPaused(frame)
@@ -112,7 +157,19 @@ class Main(Module):
             frameNum += 1
             self.fpsCounter.tick()
 
-        self.capture.cleanup()
+        self.cleanup()
+
+    def createCapture(self):
+        if self.replay:
+            return ReplayCapture(self.replay, fps=self.replayFps)
+
+        # win32 only
+        from rdr2_ai.utils.capture import Capture
+        return Capture(self.captureWindowKeyword, updateWindow=False)
+
+    def cleanup(self):
+        if self.capture is not None:
+            self.capture.cleanup()
         self.actionModule.cleanup()
         self.actionHandler.cleanup()
         if self.configWindow:
@@ -120,6 +177,145 @@ class Main(Module):
         if self.profiler:
             self.profiler.printStats()
 
+    def runPipelinedLoop(self):
+
+        # capture, analysis and actuation run concurrently. frames and action
+        # lists only keep the newest, releases of a dropped action list are
+        # carried over to the next one (held keys must be released)
+
+        self.initCountdown()
+
+        self.stopEvent = Event()
+        self.frameQueue = LatestQueue(maxsize=1)
+        self.actionQueue = LatestActionsQueue(lambda action: action[0] in (ActionType.RELEASE, ActionType.DONE))
+        self.latencies = {name: LatencyCounter(name) for name in ['capture', 'analysis', 'actuation', 'reaction']}
+
+        if self.configWindow:
+            self.configWindow.startLoop()
+
+        stageThreads = [Thread(target=self.captureStage, daemon=True),
+                        Thread(target=self.analysisStage, daemon=True)]
+        for thread in stageThreads:
+            thread.start()
+
+        # actuation stays on the main thread. cleanup (releasing every held
+        # key) also runs on errors and ctrl+c
+        try:
+            self.actuationStage()
+        finally:
+            self.stopEvent.set()
+            for thread in stageThreads:
+                thread.join()
+
+            self.print(f'dropped {self.frameQueue.numDropped} stale frames, '
+                       f'{self.actionQueue.numDropped} stale action lists.')
+            for latency in self.latencies.values():
+                self.print(latency.summary())
+
+            self.cleanup()
+
+    def captureStage(self):
+        try:
+            self.capture = self.createCapture()
+
+            frameNum = 0
+            while not self.stopEvent.is_set():
+                startTime = perf_counter()
+                frame = self.capture.captureWindow(self.getRequiredRegions())
+                self.latencies['capture'].add(perf_counter() - startTime)
+
+                if frame is None:
+                    # replay finished, analysis stops after the queued frames
+                    self.frameQueue.put(None)
+                    break
+
+                self.frameQueue.put(Stamped(frameNum, startTime, frame))
+                frameNum += 1
+
+        except BaseException:
+            # the other stages would wait forever
+            self.stopEvent.set()
+            raise
+
+        finally:
+            if self.capture is not None:
+                self.capture.cleanup()
+                self.capture = None
+
+    def analysisStage(self):
+        try:
+            while not self.stopEvent.is_set():
+                try:
+                    item = self.frameQueue.get(timeout=0.1)
+                except Empty:
+                    continue
+
+                if item is None:
+                    self.print('no more frames.')
+                    break
+
+                # skip frames while earlier actions are still playing out
+                if self.actionHandler.isBusy() or not self.actionQueue.empty():
+                    continue
+
+                self.print(f'frame {item.index}')
+                startTime = perf_counter()
+
+                # stop if in pause menu
+                if self.pauseMenu.gameIsPaused(item.data):
+                    self.print('game is paused.')
+                    break
+
+                actions = self.actionModule.getActions(item.data)
+                self.latencies['analysis'].add(perf_counter() - startTime)
+
+                self.actionQueue.put(Stamped(item.index, item.captureTime, actions))
+                self.fpsCounter.tick()
+
+        finally:
+            # analysis ending (errors included) ends the run
+            self.stopEvent.set()
+
+    def actuationStage(self):
+        while not self.stopEvent.is_set():
+            # wake up in time for the next scheduled input event
+            timeout = self.actionHandler.timeToNextEvent()
+            timeout = 0.1 if timeout is None else min(timeout, 0.1)
+            try:
+                item = self.actionQueue.get(timeout=timeout)
+            except Empty:
+                self.actionHandler.tick()
+                continue
+
+            startTime = perf_counter()
+            if item.data:
+                # time from the frame being grabbed to acting on it
+                self.latencies['reaction'].add(startTime - item.captureTime)
+
+            shouldContinue = self.actionHandler.doActions(item.data)
+            self.latencies['actuation'].add(perf_counter() - startTime)
+
+            if not shouldContinue:
+                break
+
+    # merged regions every module needs this frame, None grabs the whole frame
+    def getRequiredRegions(self):
+        if not self.useROI:
+            return None
+
+        frameSize = self.capture.getFrameSize()
+        if frameSize is None:
+            return None
+
+        regions = []
+        for module in [self.pauseMenu, self.actionModule]:
+            moduleRegions = module.requiredRegions(frameSize)
+            if moduleRegions is None:
+                return None
+            regions.extend(moduleRegions)
+
+        return mergeRegions(regions, frameSize, slack=config.regionMergeSlack)
+
     def initCountdown(self):
         seconds = self.initTime
         print(f'starting in', end='')
@@ -138,6 +334,9 @@ if __name__ == '__main__':
     argParser.add_argument('--showConfigWindow', '-c',
                            default=False, action='store_true',
                            help='Show visualizations of the inner workings.')
+    argParser.add_argument('--telemetry',
+                           default=False, action='store_true',
+                           help='Serve the inner workings headless on localhost (see config.telemetryPort) instead of a window.')
     argParser.add_argument('--recordDir', '-d',
                            default='', required=' record' in sys.argv,
                            help='The directory to store recorded frames in.')
@@ -147,6 +346,21 @@ if __name__ == '__main__':
     argParser.add_argument('--doProfile', '-p',
                            default=False, action='store_true',
                            help='Show profiling information on exit.')
+    argParser.add_argument('--pipeline',
+                           default=False, action='store_true',
+                           help='Run capture, analysis and actuation concurrently.')
+    argParser.add_argument('--scheduleActions', '-s',
+                           default=False, action='store_true',
+                           help='Send timed input events without blocking on taps/pauses.')
+    argParser.add_argument('--replay', '-r',
+                           default='', type=str,
+                           help='Replay a recorded frame directory or video instead of the game window.')
+    argParser.add_argument('--replayFps',
+                           default=0, type=float,
+                           help='Replay rate in frames/s (0 = as fast as possible).')
+    argParser.add_argument('--roi',
+                           default=False, action='store_true',
+                           help='Only capture the screen regions the active modules read.')
 
     parsedArgsObj = argParser.parse_args()
     aiArgs = AIArguments(**vars(parsedArgsObj))
@@ -26,3 +26,8 @@ class Module:
 
         outStr = f'[{className}]{whiteSpaceA}{timeStr}{whiteSpaceB}{pidStr}{whiteSpaceC}{s}'
         print(outStr, end=end, flush=flush)
+
+    # regions (x1,y1,x2,y2) of a frame of size (height, width) that this module
+    # reads. None means the whole frame is needed
+    def requiredRegions(self, frameSize):
+        return None
@@ -0,0 +1,62 @@
+import cv2
+import numpy as np
+
+from rdr2_ai import config
+from rdr2_ai.analysisModules.minimap import MinimapReader
+
+
+def makeIcon():
+    icon = np.zeros((15, 15, 3), np.uint8)
+    cv2.circle(icon, (7, 7), 6, (40, 40, 220), -1)
+    cv2.line(icon, (7, 2), (7, 12), (230, 230, 230), 2)
+    return icon
+
+
+def paste(im, patch, center):
+    r, c = center
+    h, w = patch.shape[:2]
+    im[r - h//2:r - h//2 + h, c - w//2:c - w//2 + w] = patch
+
+
+def makeMinimap(icon, center, decoyCenter=None, seed=0):
+    # smooth colored texture, like terrain
+    rng = np.random.default_rng(seed)
+    im = rng.integers(60, 200, (40, 40, 3), dtype=np.uint8)
+    im = cv2.resize(im, (320, 320), interpolation=cv2.INTER_CUBIC)
+    paste(im, icon, center)
+    if decoyCenter is not None:
+        # a marker of the same color without the line
+        decoy = np.zeros_like(icon)
+        cv2.circle(decoy, (7, 7), 6, (40, 40, 220), -1)
+        paste(im, decoy, decoyCenter)
+    return im
+
+
+def test_reader_without_target_icon(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, 'minimapTracking', True)
+    minimapReader = MinimapReader()
+    assert minimapReader.targetIcon is None
+    assert minimapReader.targetTracker is None
+    assert minimapReader.choreTracker is not None
+
+
+def test_target_tracker_reacquires_outside_window(tmp_path, monkeypatch):
+    icon = makeIcon()
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'images').mkdir()
+    cv2.imwrite(str(tmp_path / 'images' / 'target_icon.png'), icon)
+    monkeypatch.setattr(config, 'minimapTracking', True)
+    minimapReader = MinimapReader()
+    tracker = minimapReader.targetTracker
+
+    assert tracker.track(makeMinimap(icon, (100, 100))) == (100, 100)
+    assert tracker.track(makeMinimap(icon, (103, 102))) == (103, 102)
+    assert tracker.numFullSearches == 1
+
+    # far outside the window around the last location, a similar marker
+    # stays inside the window and scores above minConfidence there
+    far = (230, 240)
+    assert max(abs(a - b) for a, b in zip(far, (103, 102))) > tracker.window
+    assert tracker.track(makeMinimap(icon, far, decoyCenter=(103, 102))) == far
+    assert tracker.numFullSearches == 2
@@ -0,0 +1,40 @@
+import numpy as np
+
+from rdr2_ai.actionModules.recorder import Recorder
+from rdr2_ai.controls.actionHandler import ActionHandler, ActionType
+from rdr2_ai.utils.pipeline import LatestActionsQueue, Stamped
+
+
+def makeRecorder(tmp_path, monkeypatch):
+    # recordings go to ./debug_ims/<recordDir>
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'debug_ims').mkdir()
+    return Recorder('rec')
+
+
+def test_recorder_actions_through_doActions(tmp_path, monkeypatch):
+    recorder = makeRecorder(tmp_path, monkeypatch)
+    actionHandler = ActionHandler(configWindow=None, dryRun=True)
+    frame = np.zeros((48, 64, 3), np.uint8)
+    try:
+        for _ in range(3):
+            assert actionHandler.doActions(recorder.getActions(frame))
+    finally:
+        recorder.cleanup()
+    assert recorder.numWritten == 3
+
+
+def test_recorder_actions_through_latest_actions_queue(tmp_path, monkeypatch):
+    recorder = makeRecorder(tmp_path, monkeypatch)
+    # same keep rule as Main.runPipelinedLoop
+    actionQueue = LatestActionsQueue(lambda action: action[0] in (ActionType.RELEASE, ActionType.DONE))
+    frame = np.zeros((48, 64, 3), np.uint8)
+    try:
+        # the second put drops the first list and checks its actions
+        for index in range(2):
+            actionQueue.put(Stamped(index, 0.0, recorder.getActions(frame)))
+    finally:
+        recorder.cleanup()
+    item = actionQueue.getNowait()
+    assert (item.index, item.data) == (1, [])
+    assert actionQueue.numDropped == 1
@@ -0,0 +1,347 @@
+import argparse
+from time import perf_counter
+
+import cv2
+import numpy as np
+
+from rdr2_ai.utils.replay import ReplayCapture
+from rdr2_ai.utils.utils import applyBBox, dilate, segmentImage
+
+
+'''
+offline benchmarks on recorded sessions (see ReplayCapture for sources)
+
+python -m rdr2_ai.utils.bench <command> <source>
+'''
+
+
+def replayFrames(source, maxFrames=0):
+    capture = ReplayCapture(source)
+    numFrames = 0
+    while (frame := capture.captureWindow()) is not None:
+        yield frame
+        numFrames += 1
+        if maxFrames and numFrames >= maxFrames:
+            break
+    capture.cleanup()
+
+def timed(fn, *args):
+    startTime = perf_counter()
+    res = fn(*args)
+    return res, perf_counter() - startTime
+
+def printTimes(name, times):
+    times = 1000 * np.array(times)
+    if len(times) == 0:
+        print(f'{name:>24}: no samples')
+        return
+    print(f'{name:>24}: n={len(times)} mean={times.mean():.3f}ms median={np.median(times):.3f}ms max={times.max():.3f}ms')
+
+
+def benchPrompts(source, maxFrames=0):
+    # tesseract vs template recognizer on the same option strips
+    from rdr2_ai.analysisModules.options import OptionsGetter
+    from rdr2_ai.analysisModules.prompts import PromptTemplateRecognizer
+
+    optionsGetter = OptionsGetter(configWindow=None, detectChanges=False, recognizer='tesseract')
+    recognizer = PromptTemplateRecognizer()
+
+    tesseractTimes, templateTimes = [], []
+    numAgree, numStrips = 0, 0
+    for frame in replayFrames(source, maxFrames):
+        for strip in optionsGetter.getOptionStrips(frame):
+            tesseractWords, dt = timed(optionsGetter.recognizeStrip, strip)
+            tesseractTimes.append(dt)
+            (label, _), dt = timed(recognizer.recognize, strip)
+            templateTimes.append(dt)
+
+            tesseractLabel = tesseractWords[0] if tesseractWords else ''
+            numAgree += (label or '') == tesseractLabel
+            numStrips += 1
+
+    optionsGetter.cleanup()
+
+    printTimes('tesseract / strip', tesseractTimes)
+    printTimes('template / strip', templateTimes)
+    print(f'agreement: {numAgree}/{numStrips}')
+
+
+def segmentBounds(im, minGap=25, pad=5, bgColor=0):
+    # (top, bottom) rows of the pieces segmentImage(im, axis=0) returns
+    h = im.shape[0]
+
+    hor_lines = np.nonzero(np.all((im == bgColor),axis=1))[0]
+    bottom_edges = (hor_lines-1)[1:]
+    upper_edges = (hor_lines+1)[:-1]
+
+    mask = (bottom_edges - minGap) > upper_edges
+    upper_edges = np.clip(upper_edges[mask] - pad,0,h)
+    bottom_edges = np.clip(bottom_edges[mask] + pad,0,h)
+
+    seperators = np.sort(np.concatenate((upper_edges,bottom_edges)))
+    return list(zip(seperators[::2], seperators[1::2]))
+
+def legacyOptionStrips(optionsGetter, optionsFrame):
+    # the option strip pipeline before it moved to native resolution, kept as a
+    # baseline. returns the strips that went to ocr (scaled up) and their
+    # (top, bottom) rows in the options frame
+    S = optionsGetter.OCRScaleFactor
+
+    optionsFrameMaskInv = np.all(optionsFrame < (255-optionsGetter.textColorTolerance),axis=2)
+    optionsFrameBin = np.zeros(optionsFrame.shape[:2],dtype=np.uint8)
+    optionsFrameBin[~optionsFrameMaskInv] = 255
+
+    textPad = int(optionsGetter.textPadding)
+    x,y,w,h = cv2.boundingRect(optionsFrameBin)
+    x1 = max(0,x-textPad)
+    y1 = max(0,y-textPad)
+    x2 = min(optionsFrameBin.shape[1],x+w+textPad)
+    y2 = min(optionsFrameBin.shape[0],y+h+textPad)
+
+    optionsFrameScaled = cv2.resize(optionsFrameBin[y1:y2,x1:x2], (0,0), fx=S, fy=S, interpolation=cv2.INTER_CUBIC)
+    optionsFramePreProc = dilate(optionsFrameScaled)
+
+    minLineHeight = int(optionsGetter.minHorLineHeight * S / 3)
+    minTextGap = int(optionsGetter.minOptionTextGap * S / 3)
+    horLineExists = any((f.shape[0] < minTextGap) and (np.mean(f) > optionsGetter.horLineCoverageThresh)
+                        for f in segmentImage(optionsFramePreProc, minGap=minLineHeight, pad=0, bgColor=0, axis=0))
+
+    bounds = segmentBounds(optionsFramePreProc, minGap=minTextGap,
+                           pad=int(optionsGetter.textPadding * S / 3), bgColor=0)
+    if len(bounds) > 0 and horLineExists:
+        bounds = bounds[:-1]
+
+    strips = [optionsFramePreProc[top:bottom] for top, bottom in bounds]
+    rows = [(y1 + top / S, y1 + bottom / S) for top, bottom in bounds]
+    return strips, rows
+
+def benchOptionStrips(source, maxFrames=0, tolerance=2):
+    # per frame cost of binarize + segment (+ upscaling the strips for ocr).
+    # both must find the same option rows, within tolerance native pixels
+    # per edge (the legacy path segments a cubic upscaled, dilated image)
+    from rdr2_ai.analysisModules.options import OptionsGetter
+
+    optionsGetter = OptionsGetter(configWindow=None, detectChanges=False)
+
+    legacyTimes, newTimes = [], []
+    numAgree, numFrames = 0, 0
+    maxDeviation = 0.0
+    for frame in replayFrames(source, maxFrames):
+        optionsGetter.updateBoundingBoxes(frame)
+        optionsFrame = applyBBox(frame, optionsGetter.optionsBB)
+
+        (legacyStrips, legacyRows), dt = timed(legacyOptionStrips, optionsGetter, optionsFrame)
+        legacyTimes.append(dt)
+
+        startTime = perf_counter()
+        strips = [optionsGetter.upscaleStrip(strip) for strip in optionsGetter.getOptionStrips(frame)]
+        newTimes.append(perf_counter() - startTime)
+
+        # rows of the strips above, from the binarized frame getOptionStrips left behind
+        rows, horLineExists = optionsGetter.findOptionRows(optionsGetter.optionsFrameBin)
+        if len(rows) > 0 and horLineExists:
+            rows = rows[:-1]
+
+        if len(rows) == len(legacyRows):
+            deviation = max([abs(a - b) for row, legacyRow in zip(rows, legacyRows)
+                                        for a, b in zip(row, legacyRow)], default=0.0)
+            maxDeviation = max(maxDeviation, deviation)
+            numAgree += deviation <= tolerance
+        numFrames += 1
+
+    optionsGetter.cleanup()
+
+    printTimes('legacy / frame', legacyTimes)
+    printTimes('native / frame', newTimes)
+    print(f'same option rows (+-{tolerance}px): {numAgree}/{numFrames}, max edge difference {maxDeviation:.1f}px')
+
+
+class LegacySplashScorer:
+
+    # Fisher.getFishCalmScore before SplashScorer, kept as the reference:
+    # full frame grayscale, scipy convolve2d, a new running mean every frame
+
+    def __init__(self, scorer):
+        self.convFilter = scorer.convFilter.astype(np.float64)
+        self.bufferLength = scorer.bufferLength
+        self.splashMean = None
+
+    def update(self, im, crop):
+        from scipy.signal import convolve2d
+
+        gray_im = cv2.cvtColor(im,cv2.COLOR_BGR2GRAY)
+        gray_im = gray_im.astype(np.float32) / 255
+
+        cT, cB, cL, cR = crop
+        splash_im = gray_im[ cT:-cB , cL:-cR ]
+
+        if self.splashMean is None:
+            self.splashMean = splash_im
+
+        norm_im = np.clip(splash_im - self.splashMean, 0, 1)
+        self.splashMean = (1/self.bufferLength) * splash_im + (1 - 1/self.bufferLength) * self.splashMean
+
+        conv_im = convolve2d(norm_im,self.convFilter,mode='valid')
+        return np.sum(conv_im ** 2) ** 0.5 / conv_im.size
+
+def benchCalmScore(source, maxFrames=0, skip=2, rtol=1e-4):
+    # legacy vs SplashScorer on the same frames, scores must agree
+    from rdr2_ai.analysisModules.splash import SplashScorer
+
+    # Fisher.getSplashCrop
+    def getSplashCrop(H, W):
+        return int(0.50*H), int(0.38*H), int(0.46*W), int(0.46*W)
+
+    scorer = SplashScorer(skip=skip)
+    legacyScorer = LegacySplashScorer(scorer)
+
+    legacyTimes, newTimes = [], []
+    maxRelDiff, numFrames = 0.0, 0
+    for frame in replayFrames(source, maxFrames):
+        im = frame[::skip,::skip]
+        H, W = im.shape[:2]
+        cT, cB, cL, cR = getSplashCrop(H, W)
+
+        legacyScore, dt = timed(legacyScorer.update, im, (cT, cB, cL, cR))
+        legacyTimes.append(dt)
+        score, dt = timed(scorer.update, im[cT:H-cB, cL:W-cR])
+        newTimes.append(dt)
+
+        relDiff = abs(score - legacyScore) / max(abs(legacyScore), 1e-12)
+        maxRelDiff = max(maxRelDiff, relDiff if legacyScore else abs(score))
+        numFrames += 1
+
+    printTimes('legacy / frame', legacyTimes)
+    printTimes('SplashScorer / frame', newTimes)
+    print(f'max relative score difference: {maxRelDiff:.2e} over {numFrames} frames '
+          f'({"ok" if maxRelDiff <= rtol else "MISMATCH"})')
+
+
+def legacyGameIsPaused(frame):
+    # PauseMenu.gameIsPaused before the mask count, kept as the reference
+    from rdr2_ai.analysisModules.pause import PauseMenu
+
+    leftFrame = frame[:   :PauseMenu.SKIP,
+                      :500:PauseMenu.SKIP]
+    H, W, C = leftFrame.shape
+    leftPx = leftFrame.reshape((H * W, C))
+
+    pxs, cnts = np.unique(leftPx, axis=0, return_counts=True)
+
+    redMask = (pxs[:,0] < PauseMenu.OTHER_THRESH) & (pxs[:,1] < PauseMenu.OTHER_THRESH) & (pxs[:,2] > PauseMenu.RED_THRESH)
+    numRedPx = np.sum(cnts[redMask])
+    numTotPx = H*W
+
+    return (numRedPx / numTotPx) > PauseMenu.PX_THRESH
+
+def benchPause(source, maxFrames=0):
+    # legacy vs mask count vs mask count with probe grid, decisions must agree
+    from rdr2_ai.analysisModules.pause import PauseMenu
+
+    detectors = {'mask count': PauseMenu(probeGrid=False), 'probe + mask count': PauseMenu()}
+
+    legacyTimes = []
+    times = {name: [] for name in detectors}
+    numSame = {name: 0 for name in detectors}
+    numPaused, numFrames = 0, 0
+    for frame in replayFrames(source, maxFrames):
+        legacyPaused, dt = timed(legacyGameIsPaused, frame)
+        legacyTimes.append(dt)
+        for name, detector in detectors.items():
+            paused, dt = timed(detector.gameIsPaused, frame)
+            times[name].append(dt)
+            numSame[name] += paused == legacyPaused
+        numPaused += legacyPaused
+        numFrames += 1
+
+    printTimes('np.unique / frame', legacyTimes)
+    for name in detectors:
+        printTimes(f'{name} / frame', times[name])
+    print(f'{numPaused}/{numFrames} paused frames')
+    for name in detectors:
+        print(f'{name}: same decision on {numSame[name]}/{numFrames} frames')
+
+
+def benchMinimapSearch(source, maxFrames=0):
+    # numba loop (reference) vs matchTemplate blob search on the minimap
+    # black masks, argmin and score must be identical
+    from rdr2_ai.analysisModules.minimap import MinimapReader
+    from rdr2_ai.utils.utils import minKernelDifference2D, minKernelSSD2D
+
+    minimapReader = MinimapReader()
+    kernel = minimapReader.isolatedCircleKernel
+
+    # numba compiles on the first call
+    _, dt = timed(minKernelDifference2D, np.zeros((2*kernel.shape[0], 2*kernel.shape[1]), dtype=np.uint8), kernel)
+    print(f'numba compile: {1000*dt:.1f}ms')
+
+    legacyTimes, newTimes = [], []
+    numSame, numFrames = 0, 0
+    for frame in replayFrames(source, maxFrames):
+        minimapIm = applyBBox(frame, minimapReader.getMinimapBB(frame.shape[:2]))
+        blackMask = minimapReader.getBlackMask(minimapIm)
+
+        legacyRes, dt = timed(minKernelDifference2D, blackMask, kernel)
+        legacyTimes.append(dt)
+        res, dt = timed(lambda: minKernelSSD2D(blackMask, kernel, scale=255))
+        newTimes.append(dt)
+
+        numSame += (float(legacyRes[0]), tuple(legacyRes[1])) == res
+        numFrames += 1
+
+    printTimes('numba / frame', legacyTimes)
+    printTimes('matchTemplate / frame', newTimes)
+    print(f'identical (score, location): {numSame}/{numFrames}')
+
+
+def benchMinimapTracker(source, maxFrames=0):
+    # full search vs MinimapTracker on the minimap black masks
+    from rdr2_ai.analysisModules.minimap import MinimapReader, MinimapTracker
+
+    minimapReader = MinimapReader()
+    kH, kW = minimapReader.isolatedCircleKernel.shape
+    tracker = MinimapTracker('chore', minimapReader.searchChorePoint, (kH//2, kW//2))
+
+    fullTimes, trackTimes, areas = [], [], []
+    numSame, numFrames = 0, 0
+    for frame in replayFrames(source, maxFrames):
+        minimapIm = applyBBox(frame, minimapReader.getMinimapBB(frame.shape[:2]))
+        blackMask = minimapReader.getBlackMask(minimapIm)
+
+        (fullLoc, _), dt = timed(minimapReader.searchChorePoint, blackMask)
+        fullTimes.append(dt)
+        trackLoc, dt = timed(tracker.track, blackMask)
+        trackTimes.append(dt)
+        areas.append(tracker.lastSearchArea)
+
+        numSame += tuple(fullLoc) == trackLoc
+        numFrames += 1
+
+    printTimes('full search / frame', fullTimes)
+    printTimes('tracker / frame', trackTimes)
+    print(f'mean search area: {np.mean(areas):.0f}px (full {blackMask.size}px)')
+    print(tracker.summary())
+    print(f'same location as full search: {numSame}/{numFrames}')
+
+
+COMMANDS = {
+    'prompts': benchPrompts,
+    'options': benchOptionStrips,
+    'calm': benchCalmScore,
+    'pause': benchPause,
+    'minimap': benchMinimapSearch,
+    'track': benchMinimapTracker,
+}
+
+
+if __name__ == '__main__':
+
+    argParser = argparse.ArgumentParser(description='Offline benchmarks on recorded sessions.')
+    argParser.add_argument('command', type=str, choices=list(COMMANDS.keys()))
+    argParser.add_argument('source', type=str,
+                           help='Recorded frame directory or video.')
+    argParser.add_argument('--maxFrames', '-n', default=0, type=int,
+                           help='Stop after this many frames (0 = all).')
+    args = argParser.parse_args()
+
+    COMMANDS[args.command](args.source, maxFrames=args.maxFrames)
@@ -0,0 +1,38 @@
+from collections import OrderedDict
+
+from rdr2_ai.module import Module
+
+
+class LRUCache(Module):
+
+    def __init__(self, maxSize: int = 256, name: str = 'cache'):
+        self.maxSize = maxSize
+        self.name = name
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        if key in self.data:
+            self.data.move_to_end(key)
+            self.hits += 1
+            return self.data[key]
+
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.maxSize:
+            self.data.popitem(last=False)
+
+    def __len__(self):
+        return len(self.data)
+
+    def hitRate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def summary(self):
+        return f'{self.name}: {self.hits} hits, {self.misses} misses ({100*self.hitRate():.1f}% hit rate), {len(self)} entries'
@@ -1,4 +1,5 @@
 from math import ceil
+import sys
 
 import cv2
 import numpy as np
@@ -16,13 +17,19 @@ class Capture(Module):
     def __init__(self, windowKeyword: str, updateWindow: bool = True):
         self.hwnd = findTopWindow(windowKeyword)
         self.sct = mss()
+        self.regionFrames = [] # (frame, regions written last) of regionFrameSize
+        self.regionFrameSize = None
         if not updateWindow:
             self.windowRect = self.getMSSWindowRect()
         self.updateWindow = updateWindow
 
-    def captureWindow(self):
+    # regions: list of (x1,y1,x2,y2) in frame coordinates, None grabs everything
+    def captureWindow(self, regions=None):
         if self.updateWindow:
             self.windowRect = self.getMSSWindowRect()
+
+        if regions is not None:
+            return self.captureRegions(regions)
         
         frame = np.asarray(self.sct.grab(self.windowRect))
 
@@ -33,6 +40,50 @@ class Capture(Module):
                      Capture.BORDER_CUT                    : -1*Capture.BORDER_CUT,
                      :3] # cut out window ribbon HACK
 
+    def captureRegions(self, regions):
+        # only grab the regions, pasted into a full size frame so that modules
+        # keep using full frame coordinates. the frames are preallocated, only
+        # what the last grab into a frame wrote has to be cleared again
+        regions = [tuple(region) for region in regions]
+        frame, lastRegions = self.getRegionFrame()
+        for x1,y1,x2,y2 in lastRegions:
+            if (x1,y1,x2,y2) not in regions:
+                frame[y1:y2, x1:x2] = 0
+
+        left = self.windowRect['left'] + Capture.BORDER_CUT
+        top = self.windowRect['top'] + Capture.BORDER_CUT + Capture.RIBBON_CUT
+        for x1,y1,x2,y2 in regions:
+            monitor = {'left': left + x1, 'top': top + y1, 'width': x2 - x1, 'height': y2 - y1}
+            frame[y1:y2, x1:x2] = np.asarray(self.sct.grab(monitor))[:, :, :3]
+
+        lastRegions[:] = regions
+        return frame
+
+    # a (frame, regions written last) nobody else holds. frames handed out
+    # earlier can still be queued or analysed (--pipeline), views of a frame
+    # keep it referenced too, so a frame is free once only the pool has it
+    def getRegionFrame(self):
+        frameSize = self.getFrameSize()
+        if frameSize != self.regionFrameSize:
+            # the window was resized
+            self.regionFrames = []
+            self.regionFrameSize = frameSize
+
+        for entry in self.regionFrames:
+            # the pool's reference and getrefcount's own
+            if sys.getrefcount(entry[0]) == 2:
+                return entry
+
+        entry = (np.zeros((*frameSize, 3), dtype=np.uint8), [])
+        self.regionFrames.append(entry)
+        return entry
+
+    # (height, width) of the frames returned by captureWindow
+    def getFrameSize(self):
+        h = self.windowRect['height'] - 2*Capture.BORDER_CUT - Capture.RIBBON_CUT
+        w = self.windowRect['width'] - 2*Capture.BORDER_CUT
+        return h, w
+
     def getMSSWindowRect(self):
         x1,y1,x2,y2 = win32gui.GetWindowRect(self.hwnd)
         return {'left': x1, 'top': y1, 'width': x2-x1, 'height': y2-y1}
@@ -1,18 +1,24 @@
 from time import time
 
+import numpy as np
+
 from rdr2_ai.module import Module
+from rdr2_ai.utils.timeSeries import TimeSeries
 
 
 class FPSCounter(Module):
 
-    def __init__(self, configWindow=None):
+    # frames/s over the last `window` frames
+    def __init__(self, configWindow=None, window: int = 10):
         self.configWindow = configWindow
         self.frameStartTime = None
+        self.frameTimes = TimeSeries(window, dtype=np.float64, window=window)
         
     def tick(self):
 
         if self.frameStartTime:        
-            currFPS = round(1/(time() - self.frameStartTime))
+            self.frameTimes.append(time() - self.frameStartTime)
+            currFPS = round(1/max(self.frameTimes.mean(), 1e-6))
             if self.configWindow:
                 self.configWindow.addDrawEvent('fps', str(currFPS))
             else:
@@ -21,4 +27,29 @@ class FPSCounter(Module):
         self.frameStartTime = time()
     
     def cleanup(self):
-        pass
\ No newline at end of file
+        pass
+
+
+class LatencyCounter(Module):
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+    def summary(self):
+        return f'{self.name}: n={self.count} mean={1000*self.mean():.2f}ms max={1000*self.max:.2f}ms'
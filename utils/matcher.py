@@ -0,0 +1,88 @@
+from rdr2_ai.module import Module
+from rdr2_ai.utils.cache import LRUCache
+from rdr2_ai.utils.utils import closeEnough
+
+
+class PromptMatcher(Module):
+
+    # fuzzy matching of ocr output against a fixed vocabulary. every ocr
+    # string is compared to the whole vocabulary once (utils.closeEnough) and
+    # remembered as a bitmask of the prompts it is close to
+
+    def __init__(self, vocabulary, n: int = 3, cacheSize: int = 512):
+        self.vocabulary = tuple(vocabulary)
+        self.n = n
+        self.bits = {prompt: 1 << i for i, prompt in enumerate(self.vocabulary)}
+        self.matchCache = LRUCache(maxSize=cacheSize, name='promptMatcher')
+        self.maskCache = {}
+
+    # bitmask of the prompts s is close to
+    def match(self, s):
+        mask = self.matchCache.get(s)
+        if mask is None:
+            mask = 0
+            for prompt, bit in self.bits.items():
+                if closeEnough(s, prompt, n=self.n):
+                    mask |= bit
+            self.matchCache.put(s, mask)
+        return mask
+
+    # bitmask of a tuple of prompts
+    def mask(self, prompts):
+        if isinstance(prompts, str):
+            return self.bits[prompts]
+
+        mask = self.maskCache.get(prompts)
+        if mask is None:
+            mask = 0
+            for prompt in prompts:
+                mask |= self.bits[prompt]
+            self.maskCache[prompts] = mask
+        return mask
+
+    def compile(self, options):
+        return PromptMatches(self, options)
+
+
+class PromptMatches:
+
+    # the ocr'd options of one frame, matched once. all queries are bit ops
+
+    def __init__(self, matcher: PromptMatcher, options):
+        self.matcher = matcher
+        self.options = options
+        self.masks = [matcher.match(option) for option in options]
+
+        self.found = 0
+        for mask in self.masks:
+            self.found |= mask
+
+    def __len__(self):
+        return len(self.options)
+
+    def __repr__(self):
+        return repr(self.options)
+
+    # any option is close to prompt (anyCloseEnough)
+    def has(self, prompt):
+        return bool(self.found & self.matcher.mask(prompt))
+
+    # option i is close to prompt (closeEnough)
+    def at(self, i, prompt):
+        return bool(self.masks[i] & self.matcher.mask(prompt))
+
+    # at most k options are not close to any of prompts (allAnyCloseEnough)
+    def allIn(self, prompts, k: int = 0):
+        mask = self.matcher.mask(prompts)
+        numWrong = sum(1 for optionMask in self.masks if not (optionMask & mask))
+        return numWrong <= k
+
+
+matchers = {}
+
+def getMatcher(vocabulary, n: int = 3):
+    # one matcher per vocabulary
+    key = (tuple(vocabulary), n)
+    if key not in matchers:
+        matchers[key] = PromptMatcher(vocabulary, n=n)
+    return matchers[key]
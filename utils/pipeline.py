@@ -0,0 +1,81 @@
+from dataclasses import dataclass
+from queue import Empty, Full, Queue
+from typing import Any
+
+
+@dataclass
+class Stamped:
+    index: int
+    captureTime: float
+    data: Any
+
+
+class LatestQueue:
+
+    # bounded queue that only keeps the newest items. putting into a full
+    # queue drops the oldest item instead of blocking the producer
+
+    def __init__(self, maxsize: int = 1):
+        self.queue = Queue(maxsize=maxsize)
+        self.numDropped = 0
+
+    def put(self, item):
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except Full:
+                try:
+                    self.queue.get_nowait()
+                    self.numDropped += 1
+                except Empty:
+                    pass
+
+    # raises queue.Empty on timeout
+    def get(self, timeout: float = None):
+        return self.queue.get(timeout=timeout)
+
+    # raises queue.Empty if there is nothing queued
+    def getNowait(self):
+        return self.queue.get_nowait()
+
+    def empty(self):
+        return self.queue.empty()
+
+
+class DroppingQueue(LatestQueue):
+
+    # bounded queue that keeps the oldest items. putting into a full queue
+    # drops the new item instead of blocking the producer
+
+    def put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except Full:
+            self.numDropped += 1
+
+
+class LatestActionsQueue(LatestQueue):
+
+    # newest action list wins, like LatestQueue. actions of a dropped list
+    # for which keep(action) holds (releases, done) are carried over to the
+    # front of the list that replaces it, so no key is left pressed
+
+    def __init__(self, keep, maxsize: int = 1):
+        super().__init__(maxsize=maxsize)
+        self.keep = keep
+
+    def put(self, item: Stamped):
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except Full:
+                try:
+                    dropped = self.queue.get_nowait()
+                    self.numDropped += 1
+                except Empty:
+                    continue
+                carried = [action for action in dropped.data if self.keep(action)]
+                if carried:
+                    item = Stamped(item.index, item.captureTime, carried + item.data)
@@ -0,0 +1,127 @@
+from time import sleep, perf_counter
+import os
+
+import cv2
+import numpy as np
+
+from rdr2_ai.module import Module
+
+
+class ReplayCapture(Module):
+
+    # drop-in for Capture that plays back a Recorder directory (segmented
+    # video + index.csv, or frame_N.jpg from older recordings) or a video
+    # file. fps <= 0 replays as fast as the consumer asks for frames.
+    # captureWindow returns None when done
+
+    def __init__(self, source: str, fps: float = 0):
+        self.source = source
+        self.fps = fps
+
+        self.framePaths = None
+        self.video = None
+        self.segmentPaths = []
+        if os.path.isdir(source) and os.path.exists(os.path.join(source, 'index.csv')):
+            self.segmentPaths, numFrames = self.getSegmentPaths(source)
+            self.print(f'replaying {numFrames} frames in {len(self.segmentPaths)} segments from {source}')
+            self.openVideo(self.segmentPaths.pop(0))
+        elif os.path.isdir(source):
+            self.framePaths = self.getFramePaths(source)
+            self.print(f'replaying {len(self.framePaths)} frames from {source}')
+        else:
+            self.openVideo(source)
+            self.print(f'replaying video {source}')
+
+        self.frameIndex = 0
+        self.startTime = None
+        self.nextFrame = None
+        self.frameSize = None
+
+    def getFramePaths(self, recordDir):
+        getNumeric = lambda f: int(''.join([c for c in f if c.isnumeric()]))
+        frameFiles = [f for f in os.listdir(recordDir) if f.startswith('frame_') and f.endswith('.jpg')]
+        frameFiles.sort(key=getNumeric)
+        return [os.path.join(recordDir, f) for f in frameFiles]
+
+    def getSegmentPaths(self, recordDir):
+        # segments in recording order, from the Recorder index
+        segments = []
+        numFrames = 0
+        with open(os.path.join(recordDir, 'index.csv')) as f:
+            next(f) # header
+            for line in f:
+                segment = int(line.split(',')[1])
+                if not segments or segments[-1] != segment:
+                    segments.append(segment)
+                numFrames += 1
+        return [os.path.join(recordDir, f'segment_{k}.avi') for k in segments], numFrames
+
+    def openVideo(self, path):
+        if self.video is not None:
+            self.video.release()
+        self.video = cv2.VideoCapture(path)
+        if not self.video.isOpened():
+            raise ValueError(f'could not open replay source {path}')
+
+    # regions: same as Capture.captureWindow. only those pixels are kept, which
+    # checks that modules do not read outside the regions they declared
+    def captureWindow(self, regions=None):
+        if self.startTime is None:
+            self.startTime = perf_counter()
+
+        if self.fps > 0:
+            # hold the requested rate
+            waitTime = self.startTime + self.frameIndex / self.fps - perf_counter()
+            if waitTime > 0:
+                sleep(waitTime)
+
+        frame = self.readFrame()
+        if frame is None:
+            return None
+        self.frameIndex += 1
+        self.frameSize = frame.shape[:2]
+
+        if regions is not None:
+            regionFrame = np.zeros_like(frame)
+            for x1,y1,x2,y2 in regions:
+                regionFrame[y1:y2, x1:x2] = frame[y1:y2, x1:x2]
+            frame = regionFrame
+
+        return frame
+
+    # (height, width) of the frames returned by captureWindow
+    def getFrameSize(self):
+        if self.frameSize is None and self.nextFrame is None:
+            # peek at the first frame
+            self.nextFrame = self.readFrame()
+            if self.nextFrame is not None:
+                self.frameSize = self.nextFrame.shape[:2]
+        return self.frameSize
+
+    def readFrame(self):
+        if self.nextFrame is not None:
+            # already read by getFrameSize
+            frame, self.nextFrame = self.nextFrame, None
+            return frame
+
+        if self.video is not None:
+            ok, frame = self.video.read()
+            while not ok and self.segmentPaths:
+                # next segment of a Recorder directory
+                self.openVideo(self.segmentPaths.pop(0))
+                ok, frame = self.video.read()
+            return frame if ok else None
+
+        if self.frameIndex >= len(self.framePaths):
+            return None
+        return cv2.imread(self.framePaths[self.frameIndex])
+
+    def throughput(self):
+        if self.startTime is None or self.frameIndex == 0:
+            return 0.0
+        return self.frameIndex / (perf_counter() - self.startTime)
+
+    def cleanup(self):
+        if self.video is not None:
+            self.video.release()
+        self.print(f'replayed {self.frameIndex} frames at {self.throughput():.1f} frames/s')
@@ -0,0 +1,75 @@
+from itertools import combinations
+
+from polyleven import levenshtein
+
+from rdr2_ai import config
+from rdr2_ai.module import Module
+from rdr2_ai.utils.cache import LRUCache
+
+
+class PromptSpellChecker(Module):
+
+    # spell correction restricted to the words of the in-game prompts.
+    # symmetric delete index: every word is stored under all of its deletes up
+    # to maxDistance, a query only has to look up its own deletes. same
+    # interface as spellchecker.SpellChecker (`in` and correction)
+
+    def __init__(self, words, maxDistance: int = 2, cacheSize: int = 1024):
+        self.words = list(dict.fromkeys(words)) # ordered, first wins ties
+        self.wordSet = set(self.words)
+        self.maxDistance = maxDistance
+
+        self.index = {}
+        for w in self.words:
+            for d in self.getDeletes(w, maxDistance):
+                self.index.setdefault(d, []).append(w)
+
+        self.corrections = LRUCache(maxSize=cacheSize, name='spellcheck')
+
+    def __contains__(self, w):
+        return w in self.wordSet
+
+    def getDeletes(self, w, maxDistance):
+        deletes = {w}
+        for k in range(1, min(maxDistance, len(w)) + 1):
+            for idxs in combinations(range(len(w)), k):
+                deletes.add(''.join(c for i, c in enumerate(w) if i not in idxs))
+        return deletes
+
+    # closest lexicon word, or w itself if nothing is close enough
+    def correction(self, w):
+        corrected = self.corrections.get(w)
+        if corrected is None:
+            corrected = self.lookup(w)
+            self.corrections.put(w, corrected)
+        return corrected
+
+    def lookup(self, w):
+        if w in self.wordSet:
+            return w
+
+        # short words get less slack, otherwise any junk becomes a prompt word
+        maxDistance = min(self.maxDistance, max(1, len(w) // 3))
+
+        candidates = set()
+        for d in self.getDeletes(w, maxDistance):
+            candidates.update(self.index.get(d, ()))
+
+        bestWord, bestDist = w, maxDistance + 1
+        for c in sorted(candidates, key=self.words.index):
+            dist = levenshtein(w, c, maxDistance)
+            if dist < bestDist:
+                bestWord, bestDist = c, dist
+
+        return bestWord
+
+
+sharedSpellChecker = None
+
+def getSpellChecker():
+    # one process wide instance, built on first use
+    global sharedSpellChecker
+    if sharedSpellChecker is None:
+        words = [w for prompt in config.knownPrompts for w in prompt.split(' ')]
+        sharedSpellChecker = PromptSpellChecker(words, maxDistance=config.spellcheckDistance)
+    return sharedSpellChecker
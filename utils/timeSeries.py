@@ -1,19 +1,93 @@
-import numpy as np
+from collections import deque
 
-from timerUtility.timer import Timer
+import numpy as np
 
 from rdr2_ai.module import Module
 
 
 '''
-future plans...
+fixed length histories of per frame signals (scores, frame times, ...)
 
-i got too excited once.
+every value is written twice, at i and i + bufferLength, so the last
+bufferLength values are always one contiguous slice of the buffer and
+ordered views never copy. moving average, running max and first difference
+are kept up to date on append
 '''
 
 
 class TimeSeries(Module):
 
+    # fill: initial value of the whole history (counts as samples), NaN = empty
+    # window: number of latest values in the moving average
     def __init__(self, bufferLength: int,
-                       dtype: type = np.float32):
-        self.dataBuffer = np.array([np.NaN for _ in range(bufferLength)])
\ No newline at end of file
+                       dtype: type = np.float32,
+                       fill: float = np.nan,
+                       window: int = 2):
+        self.bufferLength = bufferLength
+        self.window = min(max(1, window), bufferLength)
+
+        self.dataBuffer = np.empty(2 * bufferLength, dtype=dtype)
+        self.head = 0 # index of the oldest value
+        self.count = 0 # number of appends, fill included
+
+        self.windowSum = 0.0
+        self.maxQueue = deque() # (count, value), values decreasing
+
+        if np.isnan(fill):
+            self.dataBuffer[:] = fill
+        else:
+            for _ in range(bufferLength):
+                self.append(fill)
+
+    def __len__(self):
+        return min(self.count, self.bufferLength)
+
+    def append(self, x):
+        n = self.bufferLength
+
+        leaving = self.latest(self.window - 1) if self.count >= self.window else 0.0
+
+        self.dataBuffer[self.head] = x
+        self.dataBuffer[self.head + n] = x
+        x = self.dataBuffer[self.head] # as stored
+        self.head = (self.head + 1) % n
+        self.count += 1
+
+        # moving average, resynced once per buffer length against drift
+        if self.count % n == 0:
+            self.windowSum = float(np.sum(self.view()[-self.window:], dtype=np.float64))
+        else:
+            self.windowSum += float(self.latest()) - float(leaving)
+
+        # running max over the buffer (monotonic queue)
+        while self.maxQueue and self.maxQueue[-1][1] <= x:
+            self.maxQueue.pop()
+        self.maxQueue.append((self.count, x))
+        if self.maxQueue[0][0] <= self.count - n:
+            self.maxQueue.popleft()
+
+    # the history, oldest first (or newest first), without copying
+    def view(self, newestFirst: bool = False):
+        n = self.bufferLength
+        ordered = self.dataBuffer[self.head:self.head + n]
+        if newestFirst:
+            return ordered[::-1]
+        return ordered
+
+    # the value k appends ago
+    def latest(self, k: int = 0):
+        return self.dataBuffer[self.head + self.bufferLength - 1 - k]
+
+    # latest(k) - latest(k + 1)
+    def diff(self, k: int = 0):
+        return self.latest(k) - self.latest(k + 1)
+
+    # mean of the latest window values
+    def mean(self):
+        return self.windowSum / min(max(1, self.count), self.window)
+
+    # max over the whole history
+    def max(self):
+        if not self.maxQueue:
+            return np.nan
+        return self.maxQueue[0][1]
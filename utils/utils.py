@@ -1,3 +1,4 @@
+from functools import lru_cache
 from itertools import combinations
 from time import time
 import math
@@ -20,6 +21,33 @@ def applyBBox(frame, boundingBox):
     boundedFrame = frame[y1:y2,x1:x2]
     return boundedFrame
 
+def mergeRegions(regions, frameSize, slack=1.5):
+    # clip (x1,y1,x2,y2) regions to the frame and merge any two whose joint
+    # bounding box is not much bigger than the two of them together
+    h, w = frameSize
+    boxes = []
+    for x1,y1,x2,y2 in regions:
+        x1, x2 = max(0, int(x1)), min(w, int(x2))
+        y1, y2 = max(0, int(y1)), min(h, int(y2))
+        if x2 > x1 and y2 > y1:
+            boxes.append((x1,y1,x2,y2))
+
+    area = lambda b: (b[2] - b[0]) * (b[3] - b[1])
+
+    merged = True
+    while merged:
+        merged = False
+        for i, j in combinations(range(len(boxes)), 2):
+            a, b = boxes[i], boxes[j]
+            union = (min(a[0],b[0]), min(a[1],b[1]), max(a[2],b[2]), max(a[3],b[3]))
+            if area(union) <= slack * (area(a) + area(b)):
+                boxes[i] = union
+                boxes.pop(j)
+                merged = True
+                break
+
+    return boxes
+
 def dilate(image, k=3, i=3):
     kernel = np.ones((k,k),np.uint8)
     return cv2.dilate(image, kernel, iterations=i)
@@ -59,6 +87,7 @@ def cropCenter(im,scale=-1,scaleW=-1,scaleH=-1):
 
     return im[yOff:-yOff,xOff:-xOff]
 
+@lru_cache(maxsize=4096)
 def closeEnough(A,B,n=3):
     n = max(2, len(A)-n, len(B)-n)
     return levenshtein(A, B, n) <= n
@@ -94,6 +123,37 @@ def minKernelDifference2D(im, kernel):
 
     return minDiff, minIndex
 
+def minKernelSSD2D(im, kernel, scale=None):
+    # same result as minKernelDifference2D (kept as the reference), from one
+    # cv2.matchTemplate sum of squared differences instead of a loop.
+    # matchTemplate also scores the last row/col, the reference does not
+    imH, imW = im.shape
+    keH, keW = kernel.shape
+    if imH <= keH or imW <= keW:
+        return 1e20, (-1, -1)
+
+    # matchTemplate works in float32, exact for integers below 2**24 only.
+    # integer inputs are divided by their common factor so the sums stay
+    # small, and rounded back to integers. callers that know it (255 for
+    # 0/255 masks) pass scale, otherwise it is found from the values
+    if scale is not None:
+        isInteger = True
+    else:
+        scale = 1
+        isInteger = np.all(np.mod(im, 1) == 0) and np.all(np.mod(kernel, 1) == 0)
+        if isInteger:
+            scale = max(1, int(np.gcd.reduce(np.concatenate((np.unique(im), np.unique(kernel))).astype(np.int64))))
+
+    diffs = cv2.matchTemplate((im / scale).astype(np.float32), (kernel / scale).astype(np.float32),
+                              cv2.TM_SQDIFF)[:-1,:-1]
+    if isInteger:
+        diffs = np.rint(diffs)
+
+    # first minimum in row major order, like the reference
+    i, j = np.unravel_index(np.argmin(diffs), diffs.shape)
+
+    return float(diffs[i,j]) * scale**2, (keH//2 + int(i), keW//2 + int(j))
+
 def saveDebugIm(im, desc=''):
     fname = f'./debug_ims/frame_{desc}_{time()}.jpg'
     cv2.imwrite(fname, im)